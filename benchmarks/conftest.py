@@ -0,0 +1,135 @@
+import importlib.util
+import os
+import random
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Number of files in the synthetic wallpaper folder (can be changed using the BENCHMARK_CORPUS_SIZE environment variable)
+CORPUS_SIZE = int(os.environ.get("BENCHMARK_CORPUS_SIZE", 10000))
+
+# Number of files per directory of the synthetic wallpaper folder
+CORPUS_DIRECTORY_SIZE = 100
+
+# Headers of the images in the synthetic wallpaper folder, every tenth file is not an image
+CORPUS_HEADERS = [
+    b"\xff\xd8\xff\xe0\x00\x10JFIF\x00",
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR",
+    b"RIFF\x00\x00\x00\x00WEBPVP8 ",
+]
+
+# Percentiles of the round times added to the benchmark results
+PERCENTILES = [50, 90, 95, 99]
+
+
+@pytest.fixture(scope="session")
+def wallpaper_changer():
+    """
+    The application module, which can not be imported by its file name.
+    """
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    spec = importlib.util.spec_from_file_location("wallpaper_changer", os.path.join(ROOT_DIR, "wallpaper-changer.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["wallpaper_changer"] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory) -> str:
+    """
+    Generate a folder of small files with image headers, spread over two levels of subdirectories.
+    """
+
+    path = tmp_path_factory.mktemp("corpus")
+    generator = random.Random(0)
+
+    for file_no in range(CORPUS_SIZE):
+        directory = path / "{:03d}".format(file_no // (CORPUS_DIRECTORY_SIZE * 10)) / "{:03d}".format(file_no // CORPUS_DIRECTORY_SIZE)
+
+        if file_no % CORPUS_DIRECTORY_SIZE == 0:
+            directory.mkdir(parents=True, exist_ok=True)
+
+        if file_no % 10 == 9:
+            content = b"not an image"
+        else:
+            content = generator.choice(CORPUS_HEADERS)
+
+        (directory / "wallpaper-{:06d}.jpg".format(file_no)).write_bytes(content + generator.randbytes(generator.randrange(64, 4096)))
+
+    return str(path)
+
+
+@pytest.fixture(scope="session", params=["gio", "subprocess"])
+def gsettings_backend(request, wallpaper_changer, tmp_path_factory):
+    """
+    A GSettings backend measuring the overhead of setting the wallpaper without the desktop itself, either writing
+    in-process using Gio or spawning a gsettings command which does nothing.
+
+    Gio writes to the memory backend of GSettings, so the actual desktop settings are not changed. It is skipped if
+    PyGObject or the schema is not installed.
+    """
+
+    schema = "org.gnome.desktop.background"
+    path = os.environ["PATH"]
+    get_gio_settings = wallpaper_changer.get_gio_settings
+    get_backend = wallpaper_changer.get_backend
+
+    backend = wallpaper_changer.GSettingsBackend(schema, "picture-uri")
+
+    if request.param == "gio":
+        pytest.importorskip("gi")
+
+        os.environ["GSETTINGS_BACKEND"] = "memory"
+        get_gio_settings.cache_clear()
+
+        if get_gio_settings(schema) is None:
+            del os.environ["GSETTINGS_BACKEND"]
+            pytest.skip("GSettings schema {} is not installed".format(schema))
+    else:
+        bin_dir = tmp_path_factory.mktemp("bin")
+        gsettings = bin_dir / "gsettings"
+        gsettings.write_text("#!/bin/sh\nexit 0\n")
+        gsettings.chmod(0o755)
+
+        os.environ["PATH"] = "{}{}{}".format(bin_dir, os.pathsep, path)
+        wallpaper_changer.get_gio_settings = lambda schema: None
+
+    wallpaper_changer.get_backend = lambda: backend
+
+    yield backend
+
+    os.environ["PATH"] = path
+    os.environ.pop("GSETTINGS_BACKEND", None)
+    get_gio_settings.cache_clear()
+    wallpaper_changer.get_gio_settings = get_gio_settings
+    wallpaper_changer.get_backend = get_backend
+
+
+@pytest.fixture
+def report(benchmark):
+    """
+    Add latency percentiles and the throughput to the results of a benchmark, given the number of items processed
+    per round.
+    """
+
+    def report(items: int = 1):
+        # There are no results with --benchmark-disable
+        if benchmark.stats is None:
+            return
+
+        data = sorted(benchmark.stats.stats.data)
+
+        for percentile in PERCENTILES:
+            index = min(int(len(data) * percentile / 100), len(data) - 1)
+
+            benchmark.extra_info["p{}_ms".format(percentile)] = round(data[index] * 1000, 3)
+
+        benchmark.extra_info["items_per_second"] = round(items / benchmark.stats.stats.mean)
+
+    return report
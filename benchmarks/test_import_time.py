@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT_DIR
+
+# Upper bound for importing the application in daemon mode (in milliseconds), can be changed using the
+# BENCHMARK_IMPORT_TIME_LIMIT environment variable for slow machines
+IMPORT_TIME_LIMIT = float(os.environ.get("BENCHMARK_IMPORT_TIME_LIMIT", 150))
+
+# Number of measurements, the fastest one is compared with the limit
+IMPORT_TIME_ROUNDS = 5
+
+# Modules which must not be imported at startup in daemon mode
+LAZY_MODULES = ["PyQt5.QtWidgets", "concurrent.futures", "ctypes", "gi", "hashlib", "subprocess"]
+
+# Script importing the application, passing the remaining arguments to it
+IMPORT_SCRIPT = """
+import importlib.util
+import sys
+
+sys.argv = sys.argv[1:]
+
+spec = importlib.util.spec_from_file_location("wallpaper_changer", sys.argv[0])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+"""
+
+
+def measure_import(*arguments: str):
+    """
+    Import the application using -X importtime, returning the total import time (in milliseconds) and the names of
+    all imported modules.
+    """
+
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT, os.path.join(ROOT_DIR, "wallpaper-changer.py")] + list(arguments),
+        stderr=subprocess.PIPE, universal_newlines=True, check=True
+    ).stderr
+
+    total_time = 0
+    modules = set()
+
+    # Lines look like "import time: <self us> | <cumulative us> | <indented module name>", following a header line
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        self_time, cumulative_time, module = line[len("import time:"):].split("|")
+
+        if not self_time.strip().isdigit():
+            continue
+
+        total_time += int(self_time) / 1000
+        modules.add(module.strip())
+
+    return total_time, modules
+
+
+def test_daemon_imports():
+    import_time, modules = measure_import("--daemon")
+
+    assert not modules.intersection(LAZY_MODULES)
+
+
+def test_daemon_import_time():
+    import_time = min(measure_import("--daemon")[0] for round_no in range(IMPORT_TIME_ROUNDS))
+
+    assert import_time < IMPORT_TIME_LIMIT
@@ -0,0 +1,40 @@
+import os
+import tracemalloc
+
+from conftest import CORPUS_DIRECTORY_SIZE
+
+# Number of entries added to the wallpaper list (can be changed using the BENCHMARK_MEMORY_SIZE environment variable),
+# no files are created for them
+MEMORY_SIZE = int(os.environ.get("BENCHMARK_MEMORY_SIZE", 1000000))
+
+
+def test_memory_per_entry(benchmark, report, wallpaper_changer):
+    def fill():
+        wallpapers = wallpaper_changer.WallpaperList(0)
+
+        tracemalloc.start()
+
+        try:
+            for file_no in range(MEMORY_SIZE):
+                file_path = "/wallpapers/{:04d}/{:04d}/wallpaper-{:07d}.jpg".format(file_no // (CORPUS_DIRECTORY_SIZE * 10), file_no // CORPUS_DIRECTORY_SIZE, file_no)
+
+                wallpapers.append(wallpaper_changer.Wallpaper(file_path, 4096, 1700000000.0))
+
+            list_size = tracemalloc.get_traced_memory()[0]
+
+            # The index of the entries by directory is only built once needed
+            wallpapers.index_directories()
+
+            index_size = tracemalloc.get_traced_memory()[0] - list_size
+        finally:
+            tracemalloc.stop()
+
+        return list_size, index_size
+
+    # The time includes the overhead of tracing every allocation, only the memory usage is of interest here
+    list_size, index_size = benchmark.pedantic(fill, rounds=1)
+
+    report(MEMORY_SIZE)
+
+    benchmark.extra_info["bytes_per_entry"] = round(list_size / MEMORY_SIZE, 1)
+    benchmark.extra_info["index_bytes_per_entry"] = round(index_size / MEMORY_SIZE, 1)
@@ -0,0 +1,48 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def wallpapers(wallpaper_changer, corpus):
+    wallpapers = wallpaper_changer.WallpaperList(0)
+    wallpapers.add_from_path(corpus)
+
+    for entry_index in wallpapers.get_unvalidated():
+        wallpapers.is_valid(entry_index)
+
+    return wallpapers
+
+
+def test_next(benchmark, report, wallpapers):
+    benchmark(wallpapers.next)
+
+    report()
+
+
+def test_previous(benchmark, report, wallpapers):
+    benchmark(wallpapers.previous)
+
+    report()
+
+
+def test_next_unvalidated(benchmark, report, wallpaper_changer, corpus):
+    # Every step has to check the files not validated in the background yet
+    def setup():
+        wallpapers = wallpaper_changer.WallpaperList(0)
+        wallpapers.add_from_path(corpus)
+        return (wallpapers,), {}
+
+    def run(wallpapers):
+        for step_no in range(100):
+            wallpapers.next()
+
+    benchmark.pedantic(run, setup=setup, rounds=5)
+
+    report(100)
+
+
+def test_set_active(benchmark, report, wallpapers, gsettings_backend):
+    wallpaper = wallpapers.get_current() or wallpapers.get_entry(0)
+
+    benchmark.pedantic(wallpaper.set_active, rounds=50)
+
+    report()
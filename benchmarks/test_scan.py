@@ -0,0 +1,112 @@
+import itertools
+import os
+import time
+import warnings
+
+import pytest
+
+# Number of files checked by the image type detection benchmark, the files of the corpus are repeated to reach it
+# (can be changed using the BENCHMARK_SNIFF_SIZE environment variable)
+SNIFF_SIZE = int(os.environ.get("BENCHMARK_SNIFF_SIZE", 100000))
+
+# Latency added to listing every directory (in seconds), simulating a network share
+# (can be changed using the BENCHMARK_SCAN_LATENCY environment variable)
+SCAN_LATENCY = float(os.environ.get("BENCHMARK_SCAN_LATENCY", 0.005))
+
+
+def test_add_from_path(benchmark, report, wallpaper_changer, corpus):
+    def scan():
+        wallpapers = wallpaper_changer.WallpaperList(0)
+        wallpapers.add_from_path(corpus)
+        return wallpapers
+
+    wallpapers = benchmark.pedantic(scan, rounds=5)
+
+    report(len(wallpapers.entry_states))
+
+
+@pytest.mark.parametrize("scan_threads", [1, None], ids=["single", "default"])
+def test_add_from_path_latency(benchmark, report, monkeypatch, wallpaper_changer, corpus, scan_threads):
+    scandir = os.scandir
+
+    def slow_scandir(path):
+        time.sleep(SCAN_LATENCY)
+        return scandir(path)
+
+    monkeypatch.setattr(wallpaper_changer.os, "scandir", slow_scandir)
+
+    if scan_threads is not None:
+        monkeypatch.setattr(wallpaper_changer, "SCAN_THREADS", scan_threads)
+
+    def scan():
+        wallpapers = wallpaper_changer.WallpaperList(0)
+        wallpapers.add_from_path(corpus)
+        return wallpapers
+
+    wallpapers = benchmark.pedantic(scan, rounds=5)
+
+    report(len(wallpapers.entry_states))
+
+    benchmark.extra_info["scan_threads"] = wallpaper_changer.SCAN_THREADS
+
+
+def test_rescan_unchanged(benchmark, report, wallpaper_changer, corpus):
+    wallpapers = wallpaper_changer.WallpaperList(0)
+    wallpapers.add_from_path(corpus)
+
+    # Only the directory mtimes are compared, as nothing changed
+    benchmark(wallpapers.add_from_path, corpus)
+
+    report(len(wallpapers.directories))
+
+
+def test_catalog_load(benchmark, report, wallpaper_changer, corpus, tmp_path):
+    wallpapers = wallpaper_changer.WallpaperList(0)
+    wallpapers.add_from_path(corpus)
+
+    catalog = wallpaper_changer.WallpaperCatalog(str(tmp_path / "catalog.sqlite"))
+    catalog.save(corpus, wallpapers)
+
+    benchmark.pedantic(lambda: catalog.load(corpus, wallpaper_changer.WallpaperList(0)), rounds=5)
+
+    report(len(wallpapers.entry_states))
+
+
+def test_is_valid(benchmark, report, wallpaper_changer, corpus):
+    file_paths = [os.path.join(directory, file_name) for directory, directories, file_names in os.walk(corpus) for file_name in file_names]
+
+    def validate(wallpapers):
+        return sum(wallpaper.is_valid() for wallpaper in wallpapers)
+
+    # New instances are created for every round, as the result is cached in the wallpaper
+    valid_count = benchmark.pedantic(validate, setup=lambda: (([wallpaper_changer.Wallpaper(file_path) for file_path in file_paths],), {}), rounds=5)
+
+    report(len(file_paths))
+
+    assert valid_count == len(file_paths) - len(file_paths) // 10
+
+
+@pytest.mark.parametrize("detector", ["sniffer", "imghdr"])
+def test_image_type(benchmark, report, wallpaper_changer, corpus, detector):
+    file_paths = [os.path.join(directory, file_name) for directory, directories, file_names in os.walk(corpus) for file_name in file_names]
+    file_paths = list(itertools.islice(itertools.cycle(file_paths), SNIFF_SIZE))
+
+    if detector == "imghdr":
+        # imghdr is deprecated and has been removed in Python 3.13
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            imghdr = pytest.importorskip("imghdr")
+
+        get_image_type = imghdr.what
+    else:
+        get_image_type = wallpaper_changer.get_image_type
+
+    def detect():
+        return sum(get_image_type(file_path) is not None for file_path in file_paths)
+
+    valid_count = benchmark.pedantic(detect, rounds=5)
+
+    report(len(file_paths))
+
+    # Every tenth file of the corpus (those with a number ending in 9) is not an image
+    assert valid_count == len(file_paths) - sum(file_path.endswith("9.jpg") for file_path in file_paths)
@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT_DIR
+
+# Script starting the application up to the event loop in the given mode, printing the peak RSS (in KiB) afterwards
+STARTUP_SCRIPT = """
+import importlib.util
+import resource
+import sys
+
+# The module checks its arguments for daemon mode
+sys.argv = sys.argv[1:]
+
+spec = importlib.util.spec_from_file_location("wallpaper_changer", sys.argv[0])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+
+from PyQt5 import QtCore, QtWidgets
+
+if module.DAEMON_MODE:
+    app = QtCore.QCoreApplication(sys.argv[:1])
+else:
+    app = QtWidgets.QApplication(sys.argv[:1])
+
+wallpaper_changer = module.WallpaperChanger()
+wallpaper_changer.load_settings()
+
+if not module.DAEMON_MODE:
+    main_window = module.MainWindow(wallpaper_changer)
+
+QtCore.QTimer.singleShot(0, app.quit)
+app.exec_()
+
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+@pytest.mark.parametrize("arguments", [["--daemon"], []], ids=["daemon", "tray"])
+def test_startup(benchmark, report, tmp_path, arguments):
+    # Use empty settings and caches, so only the startup itself is measured
+    environment = dict(os.environ, HOME=str(tmp_path), XDG_CONFIG_HOME=str(tmp_path / "config"), XDG_CACHE_HOME=str(tmp_path / "cache"))
+    environment.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    def start():
+        return subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT, os.path.join(ROOT_DIR, "wallpaper-changer.py")] + arguments, env=environment, universal_newlines=True)
+
+    output = benchmark.pedantic(start, rounds=5)
+
+    report()
+
+    benchmark.extra_info["max_rss_kib"] = int(output.split()[-1])
@@ -1,236 +1,2044 @@
 #! /usr/bin/env python3
-import ctypes
-import imghdr
+import argparse
+import array
+import collections
+import functools
+import importlib.util
+import itertools
+import json
 import os
 import platform
 import random
-import subprocess
+import shutil
+import signal
+import sqlite3
 import sys
-from typing import Optional
+import threading
+import time
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
-from PyQt5 import QtWidgets, QtGui, QtCore
+from PyQt5 import QtGui, QtCore
+
+# The tray icon and settings window are not used in daemon mode, QtWidgets is not even imported then
+DAEMON_MODE = "--daemon" in sys.argv[1:]
+
+if not DAEMON_MODE:
+    from PyQt5 import QtWidgets
+
+# Modules only used by some backends or by the background workers (subprocess, ctypes, hashlib, concurrent.futures
+# and PyGObject) are imported where they are used, keeping them out of the startup time
+
+# Number of threads used to list directories while scanning a folder
+SCAN_THREADS = 8
+
+# Number of threads used to check the validity of wallpapers in the background
+VALIDATION_THREADS = 4
+
+# Number of wallpapers passed from the scan worker to the GUI thread at once
+SCAN_BATCH_SIZE = 1000
+
+# Delay for collecting file system events before applying them to the wallpaper list
+WATCH_DELAY = 250
+
+# Interval of the incremental rescan used if not all directories can be watched (e.g. inotify watch limit reached)
+RESCAN_INTERVAL = 5 * 60 * 1000
 
 if platform.system() == "Linux":
     import dbus
+    import dbus.exceptions
     import dbus.mainloop.glib
     import dbus.service
 else:
     dbus = None
 
+# Quiet period after changing to another wallpaper before it is applied (in milliseconds)
+APPLY_DELAY = 300
+
+# Time after which setting the wallpaper is considered as failed (in seconds)
+APPLY_TIMEOUT = 10
+
+# Maximum number of timed out attempts to set the wallpaper which may block a thread at the same time
+APPLY_MAX_TIMED_OUT = 3
+
+# Maximum size of all wallpapers scaled to the screen resolution kept in the cache (in bytes)
+SCALED_CACHE_SIZE = 512 * 1024 * 1024
+
+# JPEG quality used for wallpapers scaled to the screen resolution
+SCALED_QUALITY = 95
+
+# How wallpapers are shown on multiple screens
+SCREEN_MODE_SAME = 0
+SCREEN_MODE_SEPARATE = 1
+SCREEN_MODE_SPAN = 2
+
+# Number of recently shown wallpapers remembered across restarts
+HISTORY_SIZE = 100
+
+# Validity of the wallpapers stored in a WallpaperList
+STATE_UNKNOWN = 0
+STATE_VALID = 1
+STATE_INVALID = 2
+STATE_REMOVED = 3
+
+# Version of the catalog schema, older catalogs are dropped and rebuilt by the next scan
+CATALOG_VERSION = 2
+
+# Number of entries stored in a single row of the catalog
+CATALOG_CHUNK_SIZE = 65536
+
+# Share of removed entries above which they are dropped when loading the catalog
+CATALOG_COMPACT_RATIO = 0.25
+
+# Number of bytes read from the start of a file to detect its image type
+IMAGE_HEADER_SIZE = 32
+
+# Image types identified by a signature at the start of the file
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"BM", "bmp"),
+    (b"\xff\x0a", "jxl"),
+    (b"\x00\x00\x00\x0cJXL \x0d\x0a\x87\x0a", "jxl"),
+    (b"\x76\x2f\x31\x01", "exr"),
+    (b"\x59\xa6\x6a\x95", "rast"),
+    (b"\x01\xda", "rgb"),
+]
+
+# Brands of ISO base media files (the "ftyp" box) containing still images
+IMAGE_BRANDS = {
+    b"avif": "avif",
+    b"avis": "avif",
+    b"heic": "heif",
+    b"heix": "heif",
+    b"heim": "heif",
+    b"heis": "heif",
+    b"hevc": "heif",
+    b"hevx": "heif",
+    b"mif1": "heif",
+    b"msf1": "heif",
+}
+
+
+def get_image_type(file_path: str) -> Optional[str]:
+    """
+    Detect the type of an image by the magic bytes at the start of the file.
+
+    Only a single small buffer is read, using pread where available.
+    """
+
+    fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+    try:
+        if hasattr(os, "pread"):
+            header = os.pread(fd, IMAGE_HEADER_SIZE, 0)
+        else:
+            header = os.read(fd, IMAGE_HEADER_SIZE)
+    finally:
+        os.close(fd)
+
+    for signature, image_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+
+    if header[4:8] == b"ftyp":
+        # The major brand is followed by the minor version and the list of compatible brands
+        box_size = min(int.from_bytes(header[:4], "big"), len(header))
+        brands = [header[8:12]] + [header[offset:offset + 4] for offset in range(16, box_size - 3, 4)]
+
+        if b"avif" in brands or b"avis" in brands:
+            return "avif"
+
+        for brand in brands:
+            if brand in IMAGE_BRANDS:
+                return IMAGE_BRANDS[brand]
+
+    # Netpbm formats (P1 to P6) followed by whitespace
+    if len(header) >= 3 and header[0:1] == b"P" and header[1:2] in b"123456" and header[2:3] in b" \t\n\r":
+        return {b"1": "pbm", b"4": "pbm", b"2": "pgm", b"5": "pgm", b"3": "ppm", b"6": "ppm"}[header[1:2]]
+
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_gio_settings(schema: str) -> Optional["Gio.Settings"]:
+    """
+    Get the Gio.Settings instance for the given schema, or None if PyGObject or the schema is not installed.
+
+    PyGObject is optional and only imported on first use, gsettings is spawned as a subprocess without it.
+    """
+
+    if platform.system() != "Linux":
+        return None
+
+    try:
+        import gi
+
+        gi.require_version("Gio", "2.0")
+
+        from gi.repository import Gio
+    except (ImportError, ValueError):
+        return None
+
+    schema_source = Gio.SettingsSchemaSource.get_default()
+
+    if schema_source is None or schema_source.lookup(schema, True) is None:
+        return None
+
+    return Gio.Settings.new(schema)
+
+
+def set_gsettings(schema: str, key: str, value: str) -> None:
+    """
+    Set a string key using GSettings.
+
+    The key is written in-process using Gio if PyGObject is available and the schema is installed, otherwise the
+    gsettings command is spawned.
+    """
+
+    settings = get_gio_settings(schema)
+
+    if settings is not None:
+        from gi.repository import Gio
+
+        settings.set_string(key, value)
+
+        # Wait until the change has been written to dconf
+        Gio.Settings.sync()
+        return
+
+    import subprocess
+
+    subprocess.call(["gsettings", "set", schema, key, value], timeout=APPLY_TIMEOUT)
+
+
+def get_gsettings(schema: str, key: str) -> Optional[str]:
+    """
+    Get a string key using GSettings, the same way as set_gsettings sets it.
+    """
+
+    settings = get_gio_settings(schema)
+
+    if settings is not None:
+        return settings.get_string(key)
+
+    import subprocess
+
+    try:
+        output = subprocess.check_output(["gsettings", "get", schema, key], timeout=APPLY_TIMEOUT, universal_newlines=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    # Strings are printed as GVariant text, i.e. in single quotes
+    return output.strip().strip("'")
+
+
+class WallpaperBackend:
+    """
+    Base class for the backends setting the desktop wallpaper.
+    """
+
+    def is_available(self) -> bool:
+        return True
+
+    def set_wallpaper(self, file_path: str) -> None:
+        raise NotImplementedError
+
+    def supports_spanning(self) -> bool:
+        return False
+
+    def set_spanned_wallpaper(self, file_path: str) -> None:
+        """
+        Set an image covering the whole virtual desktop, spanning all screens.
+
+        Only used if supports_spanning() returns True, other backends show the same wallpaper on all screens.
+        """
+
+        raise NotImplementedError
+
+
+class GSettingsBackend(WallpaperBackend):
+    """
+    Backend for GNOME and derived desktops, which span an image using the "spanned" picture option.
+
+    The option chosen by the user is kept while spanning (across restarts as well) and restored afterwards.
+    """
+
+    def __init__(self, schema: str, key: str, options_key: str = "picture-options"):
+        self.schema = schema
+        self.key = key
+        self.options_key = options_key
+        self.settings_key = "gsettings/{}/{}".format(schema, options_key)
+        self.previous_options: Optional[str] = None
+
+    def supports_spanning(self) -> bool:
+        return True
+
+    def get_previous_options(self) -> str:
+        """
+        Get the option to restore once the wallpaper is not spanned anymore, or an empty string if it is not spanned.
+        """
+
+        if self.previous_options is None:
+            self.previous_options = QtCore.QSettings("SelfCoders", "WallpaperChanger").value(self.settings_key, "", type=str)
+
+        return self.previous_options
+
+    def set_previous_options(self, options: str) -> None:
+        self.previous_options = options
+
+        QtCore.QSettings("SelfCoders", "WallpaperChanger").setValue(self.settings_key, options)
+
+    def set_wallpaper(self, file_path: str) -> None:
+        set_gsettings(self.schema, self.key, QtCore.QUrl.fromLocalFile(file_path).toString())
+
+        previous_options = self.get_previous_options()
+
+        if previous_options:
+            set_gsettings(self.schema, self.options_key, previous_options)
+            self.set_previous_options("")
+
+    def set_spanned_wallpaper(self, file_path: str) -> None:
+        set_gsettings(self.schema, self.key, QtCore.QUrl.fromLocalFile(file_path).toString())
+
+        if not self.get_previous_options():
+            self.set_previous_options(get_gsettings(self.schema, self.options_key) or "zoom")
+            set_gsettings(self.schema, self.options_key, "spanned")
+
+
+class CommandBackend(WallpaperBackend):
+    """
+    Backend running a command, "{}" in its arguments is replaced by the file path.
+
+    A different command can be given for images spanning all screens.
+    """
+
+    def __init__(self, *command: str, spanned_command: Iterable[str] = ()):
+        self.command = command
+        self.spanned_command = tuple(spanned_command)
+
+    def is_available(self) -> bool:
+        return shutil.which(self.command[0]) is not None
+
+    def supports_spanning(self) -> bool:
+        return bool(self.spanned_command)
+
+    def set_wallpaper(self, file_path: str) -> None:
+        import subprocess
+
+        subprocess.call([argument.format(file_path) for argument in self.command], timeout=APPLY_TIMEOUT)
+
+    def set_spanned_wallpaper(self, file_path: str) -> None:
+        import subprocess
+
+        subprocess.call([argument.format(file_path) for argument in self.spanned_command], timeout=APPLY_TIMEOUT)
+
+
+class SwaybgBackend(CommandBackend):
+    """
+    Backend for sway and other wlroots based compositors, swaybg keeps running to show the wallpaper.
+    """
+
+    def __init__(self):
+        super().__init__("swaybg")
+
+        self.process: Optional["subprocess.Popen"] = None
+
+    def set_wallpaper(self, file_path: str) -> None:
+        import subprocess
+
+        previous_process = self.process
+
+        self.process = subprocess.Popen(["swaybg", "--mode", "fill", "--image", file_path])
+
+        # The old instance is stopped after starting the new one to not show the background color in between
+        if previous_process is not None:
+            previous_process.terminate()
+            previous_process.wait()
+
+
+class HyprpaperBackend(CommandBackend):
+    def __init__(self):
+        super().__init__("hyprctl")
+
+    def set_wallpaper(self, file_path: str) -> None:
+        import subprocess
+
+        subprocess.call(["hyprctl", "hyprpaper", "preload", file_path], timeout=APPLY_TIMEOUT)
+        subprocess.call(["hyprctl", "hyprpaper", "wallpaper", ",{}".format(file_path)], timeout=APPLY_TIMEOUT)
+        subprocess.call(["hyprctl", "hyprpaper", "unload", "unused"], timeout=APPLY_TIMEOUT)
+
+
+class PlasmaBackend(WallpaperBackend):
+    """
+    Backend for KDE Plasma, running a script in the Plasma shell via D-Bus.
+
+    The connection to the Plasma shell is kept, so changing the wallpaper only takes a single D-Bus call.
+    """
+
+    SCRIPT = """
+        desktops().forEach(function(desktop) {{
+            desktop.wallpaperPlugin = "org.kde.image";
+            desktop.currentConfigGroup = ["Wallpaper", "org.kde.image", "General"];
+            desktop.writeConfig("Image", {});
+        }});
+    """
+
+    def __init__(self, session_bus: "dbus.Bus"):
+        self.session_bus = session_bus
+        self.plasma_shell = None
+
+    def set_wallpaper(self, file_path: str) -> None:
+        if self.plasma_shell is None:
+            self.plasma_shell = dbus.Interface(self.session_bus.get_object("org.kde.plasmashell", "/PlasmaShell"), "org.kde.PlasmaShell")
+
+        try:
+            self.plasma_shell.evaluateScript(self.SCRIPT.format(json.dumps(QtCore.QUrl.fromLocalFile(file_path).toString())))
+        except dbus.exceptions.DBusException:
+            # Connect again on the next change, e.g. if the Plasma shell has been restarted
+            self.plasma_shell = None
+            raise
+
+
+class MacOSBackend(WallpaperBackend):
+    def set_wallpaper(self, file_path: str) -> None:
+        import subprocess
+
+        script = """
+            /usr/bin/osascript<<END
+            tell application "Finder"
+            set desktop picture to POSIX file "{}"
+            end tell
+            END
+        """
+
+        subprocess.Popen(script.format(file_path), shell=True)
+
+
+class WindowsBackend(WallpaperBackend):
+    def set_wallpaper(self, file_path: str) -> None:
+        import ctypes
+
+        ctypes.windll.user32.SystemParametersInfoW(20, 0, file_path, 0)
+
+
+# Registered backends by name with the desktop environments they are used for
+backends: Dict[str, Tuple[WallpaperBackend, Set[str]]] = {}
+
+
+def register_backend(name: str, backend: WallpaperBackend, desktops: Iterable[str] = ()) -> None:
+    """
+    Register a backend for the given desktop environments (as found in XDG_CURRENT_DESKTOP or DESKTOP_SESSION).
+
+    Backends without desktop environments are generic fallbacks, used if they are available and no backend for the
+    current desktop environment has been registered.
+    """
+
+    backends[name] = backend, {desktop.lower() for desktop in desktops}
+
+
+register_backend("gnome", GSettingsBackend("org.gnome.desktop.background", "picture-uri"), ["gnome", "gnome-wayland", "unity", "ubuntu", "pantheon", "budgie-desktop", "budgie", "pop"])
+register_backend("cinnamon", GSettingsBackend("org.cinnamon.desktop.background", "picture-uri"), ["cinnamon", "x-cinnamon"])
+register_backend("mate", GSettingsBackend("org.mate.background", "picture-filename"), ["mate"])
+register_backend("sway", SwaybgBackend(), ["sway"])
+register_backend("hyprland", HyprpaperBackend(), ["hyprland"])
+register_backend("feh", CommandBackend("feh", "--no-fehbg", "--bg-fill", "{}", spanned_command=["feh", "--no-fehbg", "--no-xinerama", "--bg-fill", "{}"]))
+register_backend("xwallpaper", CommandBackend("xwallpaper", "--zoom", "{}", spanned_command=["xwallpaper", "--no-randr", "--zoom", "{}"]))
+
+
+def load_backend_plugins(directory: str) -> None:
+    """
+    Load the backend plugins found in the given directory.
+
+    Every plugin is a Python file defining a register function, which gets this module passed to subclass
+    WallpaperBackend and call register_backend.
+    """
+
+    if not os.path.isdir(directory):
+        return
+
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".py"):
+            continue
+
+        spec = importlib.util.spec_from_file_location("wallpaper_changer_backend_{}".format(file_name[:-3]), os.path.join(directory, file_name))
+        plugin = importlib.util.module_from_spec(spec)
+
+        try:
+            spec.loader.exec_module(plugin)
+            plugin.register(sys.modules[__name__])
+        except Exception as exception:
+            print("Unable to load backend plugin {}: {}".format(file_name, exception), file=sys.stderr)
+
+
+def get_desktops() -> Set[str]:
+    desktops = set()
+
+    for variable in ["XDG_CURRENT_DESKTOP", "DESKTOP_SESSION"]:
+        desktops.update(desktop.lower() for desktop in os.environ.get(variable, "").split(":") if desktop)
+
+    if os.environ.get("SWAYSOCK"):
+        desktops.add("sway")
+
+    if os.environ.get("HYPRLAND_INSTANCE_SIGNATURE"):
+        desktops.add("hyprland")
+
+    return desktops
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend() -> Optional[WallpaperBackend]:
+    """
+    Get the backend for the current platform and desktop environment, which is only detected once.
+    """
+
+    if platform.system() == "Windows":
+        return WindowsBackend()
+    elif platform.system() == "Darwin":
+        return MacOSBackend()
+
+    desktops = get_desktops()
+
+    for backend, backend_desktops in backends.values():
+        if desktops & backend_desktops:
+            return backend
+
+    for backend, backend_desktops in backends.values():
+        if not backend_desktops and backend.is_available():
+            return backend
+
+    return None
+
+
+class ScaledWallpaperCache:
+    """
+    Disk cache of wallpapers scaled down to the screen resolution, so the desktop does not have to decode and scale
+    the full original image on every change.
+
+    Entries are keyed by the path, size and mtime of the original and the screen resolution. The least recently used
+    entries are removed once the cache grows above its maximum size.
+    """
+
+    def __init__(self, directory: str, max_size: int = SCALED_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_default_path() -> str:
+        return os.path.join(QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericCacheLocation), "WallpaperChanger", "scaled")
+
+    @staticmethod
+    def get_screen_size() -> Optional[QtCore.QSize]:
+        """
+        Get the size in physical pixels required to cover the largest screen.
+
+        Must be called from the GUI thread, returns None if screens are not known (i.e. in daemon mode).
+        """
+
+        if not isinstance(QtCore.QCoreApplication.instance(), QtGui.QGuiApplication):
+            return None
+
+        width = 0
+        height = 0
+
+        for screen in QtGui.QGuiApplication.screens():
+            size = screen.size() * screen.devicePixelRatio()
+
+            width = max(width, size.width())
+            height = max(height, size.height())
+
+        if not width or not height:
+            return None
+
+        return QtCore.QSize(width, height)
+
+    @staticmethod
+    def get_screen_geometries() -> List[QtCore.QRect]:
+        """
+        Get the geometries of all screens on the virtual desktop in physical pixels, ordered with the primary screen
+        first.
+
+        Must be called from the GUI thread, returns an empty list if screens are not known (i.e. in daemon mode).
+        """
+
+        if not isinstance(QtCore.QCoreApplication.instance(), QtGui.QGuiApplication):
+            return []
+
+        primary_screen = QtGui.QGuiApplication.primaryScreen()
+        screens = sorted(QtGui.QGuiApplication.screens(), key=lambda screen: screen is not primary_screen)
+
+        if not screens:
+            return []
+
+        # Screens with different scale factors are placed using the highest one, so the geometries do not overlap
+        ratio = max(screen.devicePixelRatio() for screen in screens)
+
+        geometries = []
+
+        for screen in screens:
+            geometry = screen.geometry()
+
+            geometries.append(QtCore.QRect(round(geometry.x() * ratio), round(geometry.y() * ratio), round(geometry.width() * ratio), round(geometry.height() * ratio)))
+
+        return geometries
+
+    def get_cache_path(self, wallpaper: "Wallpaper", screen_size: QtCore.QSize) -> str:
+        return self.get_key_path("{}\0{}\0{}\0{}x{}".format(wallpaper.file_path, wallpaper.size, wallpaper.mtime, screen_size.width(), screen_size.height()))
+
+    def get_key_path(self, key: str) -> str:
+        import hashlib
+
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest() + ".jpg")
+
+    def get_scaled(self, wallpaper: "Wallpaper", screen_size: QtCore.QSize) -> str:
+        """
+        Get the path of the wallpaper scaled to cover the given screen size, rendering it if not cached yet.
+
+        The path of the original is returned if it is not larger than the screen or can not be read by Qt.
+        """
+
+        cache_path = self.get_cache_path(wallpaper, screen_size)
+
+        try:
+            # The mtime of the cached files is used to find the least recently used ones
+            os.utime(cache_path)
+            return cache_path
+        except FileNotFoundError:
+            pass
+
+        reader = QtGui.QImageReader(wallpaper.file_path)
+
+        if not self.set_scaled_size(reader, screen_size):
+            return wallpaper.file_path
+
+        image = reader.read()
+
+        if image.isNull() or not self.save(image, cache_path):
+            return wallpaper.file_path
+
+        return cache_path
+
+    def get_composite(self, wallpapers: List["Wallpaper"], geometries: List[QtCore.QRect]) -> str:
+        """
+        Get the path of an image covering the bounding rectangle of the given screen geometries, with every wallpaper
+        scaled to cover the geometry at the same position.
+
+        A single geometry covering all screens is used to span one wallpaper.
+        """
+
+        key = "\0".join(
+            "{}\0{}\0{}\0{},{},{}x{}".format(wallpaper.file_path, wallpaper.size, wallpaper.mtime, geometry.x(), geometry.y(), geometry.width(), geometry.height())
+            for wallpaper, geometry in zip(wallpapers, geometries)
+        )
+
+        cache_path = self.get_key_path(key)
+
+        try:
+            os.utime(cache_path)
+            return cache_path
+        except FileNotFoundError:
+            pass
+
+        bounding_rect = QtCore.QRect()
+
+        for geometry in geometries:
+            bounding_rect = bounding_rect.united(geometry)
+
+        composite = QtGui.QImage(bounding_rect.size(), QtGui.QImage.Format_RGB32)
+        composite.fill(QtCore.Qt.black)
+
+        painter = QtGui.QPainter(composite)
+
+        try:
+            for wallpaper, geometry in zip(wallpapers, geometries):
+                reader = QtGui.QImageReader(wallpaper.file_path)
+
+                self.set_scaled_size(reader, geometry.size())
+
+                image = reader.read()
+
+                if image.isNull():
+                    raise OSError("Unable to read {}: {}".format(wallpaper.file_path, reader.errorString()))
+
+                # Smaller images are scaled up, larger ones have already been decoded at about the right size
+                if image.size() != image.size().scaled(geometry.size(), QtCore.Qt.KeepAspectRatioByExpanding):
+                    image = image.scaled(geometry.size(), QtCore.Qt.KeepAspectRatioByExpanding, QtCore.Qt.SmoothTransformation)
+
+                # Crop the image to the geometry, keeping the center
+                source_rect = QtCore.QRect(QtCore.QPoint(0, 0), geometry.size())
+                source_rect.moveCenter(image.rect().center())
+
+                painter.drawImage(geometry.translated(-bounding_rect.topLeft()), image, source_rect)
+        finally:
+            painter.end()
+
+        if not self.save(composite, cache_path):
+            raise OSError("Unable to write {}".format(cache_path))
+
+        return cache_path
+
+    @staticmethod
+    def set_scaled_size(reader: QtGui.QImageReader, target_size: QtCore.QSize) -> bool:
+        """
+        Let the reader decode the image scaled down to cover the target size, at a reduced size where the image
+        plugin supports it.
+
+        Returns False if the image can not be read or is not larger than the target size.
+        """
+
+        reader.setAutoTransform(True)
+
+        image_size = reader.size()
+
+        if not image_size.isValid():
+            return False
+
+        # The target size has to be compared with the image as it is shown (i.e. after applying the EXIF orientation)
+        if reader.transformation() & QtGui.QImageIOHandler.TransformationRotate90:
+            target_size = target_size.transposed()
+
+        if image_size.width() <= target_size.width() or image_size.height() <= target_size.height():
+            return False
+
+        reader.setScaledSize(image_size.scaled(target_size, QtCore.Qt.KeepAspectRatioByExpanding))
+
+        return True
+
+    def save(self, image: QtGui.QImage, cache_path: str) -> bool:
+        temporary_path = "{}.{}.tmp".format(cache_path, threading.get_ident())
+
+        if not image.save(temporary_path, "JPEG", SCALED_QUALITY):
+            return False
+
+        os.replace(temporary_path, cache_path)
+
+        self.evict()
+
+        return True
+
+    def evict(self) -> None:
+        with self.lock:
+            entries = []
+            total_size = 0
+
+            with os.scandir(self.directory) as iterator:
+                for entry in iterator:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+
+            entries.sort()
+
+            # Always keep the most recently used entries, which are the wallpaper shown and the prefetched one
+            for mtime, size, file_path in entries[:-2]:
+                if total_size <= self.max_size:
+                    break
+
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+
+                total_size -= size
+
+
+class Wallpaper:
+    __slots__ = ("file_path", "size", "mtime", "valid")
+
+    def __init__(self, file_path: str, size: int = 0, mtime: float = 0, valid: Optional[bool] = None):
+        self.file_path = file_path
+        self.size = size
+        self.mtime = mtime
+        self.valid = valid
+
+    def is_valid(self) -> bool:
+        # The result is cached. A file changed in place keeps it until its directory is listed again, which only
+        # happens once the directory mtime changes or the watcher reports an event in it (the contents of files are
+        # not watched).
+        if self.valid is None:
+            try:
+                self.valid = get_image_type(self.file_path) is not None
+            except OSError:
+                self.valid = False
+
+        return self.valid
+
+    def set_active(self, scaled_cache: Optional[ScaledWallpaperCache] = None, screen_size: Optional[QtCore.QSize] = None) -> None:
+        backend = get_backend()
+
+        if backend is None:
+            return
+
+        if scaled_cache is not None and screen_size is not None:
+            backend.set_wallpaper(scaled_cache.get_scaled(self, screen_size))
+        else:
+            backend.set_wallpaper(self.file_path)
+
+
+class Permutation:
+    """
+    Pseudo-random permutation of the numbers 0 to 2^bits - 1, computed on demand by a Feistel network.
+
+    Neither the permutation nor its inverse has to be materialized, it is fully defined by the seed and the number of
+    bits. The network works on an even number of bits, values outside of the domain are mapped back into it by
+    cycle walking.
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, seed: int, bits: int):
+        self.seed = seed
+        self.bits = bits
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.size = 1 << bits
+
+        generator = random.Random(seed)
+        self.round_keys = [generator.getrandbits(32) for round_no in range(self.ROUNDS)]
+
+    def round_function(self, round_no: int, value: int) -> int:
+        value = ((value ^ self.round_keys[round_no]) * 0x45d9f3b) & 0xffffffff
+        value = ((value ^ (value >> 16)) * 0x45d9f3b) & 0xffffffff
+
+        return (value ^ (value >> 16)) & self.half_mask
+
+    def encrypt(self, value: int) -> int:
+        left = value >> self.half_bits
+        right = value & self.half_mask
+
+        for round_no in range(self.ROUNDS):
+            left, right = right, left ^ self.round_function(round_no, right)
+
+        return (left << self.half_bits) | right
+
+    def decrypt(self, value: int) -> int:
+        left = value >> self.half_bits
+        right = value & self.half_mask
+
+        for round_no in reversed(range(self.ROUNDS)):
+            left, right = right ^ self.round_function(round_no, left), left
+
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, position: int) -> int:
+        value = self.encrypt(position)
+
+        while value >= self.size:
+            value = self.encrypt(value)
+
+        return value
+
+    def index(self, value: int) -> int:
+        position = self.decrypt(value)
+
+        while position >= self.size:
+            position = self.decrypt(position)
+
+        return position
+
+
+class WallpaperList:
+    """
+    List of wallpapers in a random, non-repeating rotation order.
+
+    The wallpapers are stored in compact arrays (interned directories, a single buffer of file names and arrays for
+    size, mtime and validity). Wallpaper objects are only created when accessing an entry, which keeps the memory
+    usage low for libraries containing millions of files.
+
+    The rotation order is a lazy permutation of the entry indices defined by a seed, so it does not need any memory
+    and stays the same as long as the entries do. Entries are only appended to the storage. Removed files are just
+    marked as such, which keeps the indices and therefore the order of all other entries stable.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.directories: Dict[str, float] = {}
+
+        self.directory_paths: List[str] = []
+        self.directory_ids: Dict[str, int] = {}
+
+        # Indices of the entries in every directory (including removed ones until they are pruned), which is only
+        # built once entries of a single directory are needed
+        self.directory_entries: Optional[List[array.array]] = None
+
+        self.entry_directories = array.array("I")
+        self.entry_names = bytearray()
+        self.entry_name_offsets = array.array("Q", [0])
+        self.entry_sizes = array.array("q")
+        self.entry_mtimes = array.array("d")
+        self.entry_states = bytearray()
+
+        # Number of entries known to be invalid and of removed ones, which are kept up to date to get the number of
+        # wallpapers in rotation without counting the states. The lock guards the states and counts, as the validity
+        # is checked from other threads as well.
+        self.invalid_count = 0
+        self.removed_count = 0
+        self.lock = threading.Lock()
+
+        # The position in the permutation, which covers at least all entries (there might be positions without entry)
+        self.position = 0
+        self.permutation = Permutation(random.getrandbits(32) if seed is None else seed, 1)
+
+        # Paths of the recently shown wallpapers, the last one is the current wallpaper
+        self.history: Deque[str] = collections.deque(maxlen=HISTORY_SIZE)
+
+    def __len__(self) -> int:
+        """
+        Get the number of wallpapers in rotation, which are all entries not known to be invalid or removed.
+        """
+
+        return len(self.entry_states) - self.invalid_count - self.removed_count
+
+    def copy(self) -> "WallpaperList":
+        wallpapers = WallpaperList(self.permutation.seed)
+
+        wallpapers.directories.update(self.directories)
+        wallpapers.directory_paths.extend(self.directory_paths)
+        wallpapers.directory_ids.update(self.directory_ids)
+
+        if self.directory_entries is not None:
+            wallpapers.directory_entries = [array.array("I", entry_indices) for entry_indices in self.directory_entries]
+
+        wallpapers.entry_directories.extend(self.entry_directories)
+        wallpapers.entry_names.extend(self.entry_names)
+        wallpapers.entry_name_offsets = array.array("Q", self.entry_name_offsets)
+        wallpapers.entry_sizes.extend(self.entry_sizes)
+        wallpapers.entry_mtimes.extend(self.entry_mtimes)
+        wallpapers.entry_states.extend(self.entry_states)
+        wallpapers.invalid_count = self.invalid_count
+        wallpapers.removed_count = self.removed_count
+        wallpapers.position = self.position
+        wallpapers.permutation = self.permutation
+        wallpapers.history.extend(self.history)
+
+        return wallpapers
+
+    def get_entry(self, entry_index: int) -> Wallpaper:
+        state = self.entry_states[entry_index]
+        name = os.fsdecode(bytes(self.entry_names[self.entry_name_offsets[entry_index]:self.entry_name_offsets[entry_index + 1]]))
+
+        return Wallpaper(
+            os.path.join(self.directory_paths[self.entry_directories[entry_index]], name),
+            self.entry_sizes[entry_index],
+            self.entry_mtimes[entry_index],
+            None if state == STATE_UNKNOWN else state == STATE_VALID
+        )
+
+    def get_entries(self) -> Iterator[Tuple[int, Wallpaper]]:
+        for entry_index in range(len(self.entry_states)):
+            if self.entry_states[entry_index] != STATE_REMOVED:
+                yield entry_index, self.get_entry(entry_index)
+
+    def get_entries_in_directory(self, directory: str) -> List[int]:
+        """
+        Get the indices of the entries in the given directory (not including subdirectories).
+        """
+
+        directory_id = self.directory_ids.get(directory)
+
+        if directory_id is None:
+            return []
+
+        entry_indices = self.index_directories()[directory_id]
+        existing_indices = array.array("I", (entry_index for entry_index in entry_indices if self.entry_states[entry_index] != STATE_REMOVED))
+
+        # Prune the removed entries from the index while at it
+        if len(existing_indices) != len(entry_indices):
+            self.directory_entries[directory_id] = existing_indices
+
+        return existing_indices
+
+    def index_directories(self) -> List[array.array]:
+        """
+        Get the indices of the entries in every directory, building the index if it does not exist yet.
+
+        Once built, the index is updated with every entry added.
+        """
+
+        if self.directory_entries is None:
+            directory_entries = [array.array("I") for directory in self.directory_paths]
+
+            for entry_index, directory_id in enumerate(self.entry_directories):
+                directory_entries[directory_id].append(entry_index)
+
+            self.directory_entries = directory_entries
+
+        return self.directory_entries
+
+    def get_directory_id(self, directory: str) -> int:
+        directory_id = self.directory_ids.get(directory)
+
+        if directory_id is None:
+            directory_id = len(self.directory_paths)
+            self.directory_paths.append(directory)
+            self.directory_ids[directory] = directory_id
+
+            if self.directory_entries is not None:
+                self.directory_entries.append(array.array("I"))
+
+        return directory_id
+
+    def append(self, wallpaper: Wallpaper) -> int:
+        directory, name = os.path.split(wallpaper.file_path)
+        directory_id = self.get_directory_id(directory)
+
+        if self.directory_entries is not None:
+            self.directory_entries[directory_id].append(len(self.entry_states))
+
+        self.entry_directories.append(directory_id)
+        self.entry_names.extend(os.fsencode(name))
+        self.entry_name_offsets.append(len(self.entry_names))
+        self.entry_sizes.append(wallpaper.size)
+        self.entry_mtimes.append(wallpaper.mtime)
+
+        if wallpaper.valid is None:
+            self.entry_states.append(STATE_UNKNOWN)
+        elif wallpaper.valid:
+            self.entry_states.append(STATE_VALID)
+        else:
+            with self.lock:
+                self.entry_states.append(STATE_INVALID)
+                self.invalid_count += 1
+
+        self.grow_permutation()
+
+        return len(self.entry_states) - 1
+
+    def get_chunk(self, chunk_no: int) -> Tuple[bytes, bytes, bytes, bytes, bytes, bytes]:
+        """
+        Get the arrays of the given chunk of CATALOG_CHUNK_SIZE entries as bytes, which is how they are stored in the
+        catalog.
+        """
+
+        start = chunk_no * CATALOG_CHUNK_SIZE
+        end = min(start + CATALOG_CHUNK_SIZE, len(self.entry_states))
+
+        return (
+            self.entry_directories[start:end].tobytes(),
+            bytes(self.entry_names[self.entry_name_offsets[start]:self.entry_name_offsets[end]]),
+            self.entry_name_offsets[start + 1:end + 1].tobytes(),
+            self.entry_sizes[start:end].tobytes(),
+            self.entry_mtimes[start:end].tobytes(),
+            bytes(self.entry_states[start:end])
+        )
+
+    def extend_chunk(self, directory_ids: bytes, names: bytes, name_offsets: bytes, sizes: bytes, mtimes: bytes, states: bytes) -> None:
+        """
+        Append a chunk of entries returned by get_chunk(), without creating a Wallpaper object per entry.
+        """
+
+        self.entry_directories.frombytes(directory_ids)
+        self.entry_names.extend(names)
+        self.entry_name_offsets.frombytes(name_offsets)
+        self.entry_sizes.frombytes(sizes)
+        self.entry_mtimes.frombytes(mtimes)
+
+        with self.lock:
+            self.entry_states.extend(states)
+            self.invalid_count += states.count(STATE_INVALID)
+            self.removed_count += states.count(STATE_REMOVED)
+
+        # Rebuilt once needed, which is cheaper than updating it for every single entry here
+        self.directory_entries = None
+
+        self.grow_permutation()
+
+    def get_chunk_count(self) -> int:
+        return -(-len(self.entry_states) // CATALOG_CHUNK_SIZE)
+
+    def compact(self) -> None:
+        """
+        Drop the removed entries from the storage.
+
+        This changes the indices and therefore the rotation order of the remaining entries, only the current
+        wallpaper is kept.
+        """
+
+        current_wallpaper = self.get_current()
+        entry_indices = [entry_index for entry_index, state in enumerate(self.entry_states) if state != STATE_REMOVED]
+        names = [self.entry_names[self.entry_name_offsets[entry_index]:self.entry_name_offsets[entry_index + 1]] for entry_index in entry_indices]
+
+        self.entry_directories = array.array("I", map(self.entry_directories.__getitem__, entry_indices))
+        self.entry_names = bytearray().join(names)
+        self.entry_name_offsets = array.array("Q", itertools.accumulate(map(len, names), initial=0))
+        self.entry_sizes = array.array("q", map(self.entry_sizes.__getitem__, entry_indices))
+        self.entry_mtimes = array.array("d", map(self.entry_mtimes.__getitem__, entry_indices))
+        self.entry_states = bytearray(map(self.entry_states.__getitem__, entry_indices))
+        self.removed_count = 0
+        self.directory_entries = None
+
+        self.position = 0
+        self.permutation = Permutation(self.permutation.seed, 1)
+        self.grow_permutation()
+
+        if current_wallpaper is not None:
+            entry_index = self.find(current_wallpaper.file_path)
+
+            if entry_index is not None:
+                self.set_current_index(entry_index)
+
+    def grow_permutation(self) -> None:
+        """
+        Grow the permutation once there are more entries than it covers, which also changes the order.
+        """
+
+        if len(self.entry_states) <= self.permutation.size:
+            return
+
+        entry_index = self.get_current_index()
+
+        self.permutation = Permutation(self.permutation.seed, (len(self.entry_states) - 1).bit_length())
+
+        if entry_index is not None:
+            self.position = self.permutation.index(entry_index)
+
+    def extend(self, wallpapers: Iterable[Wallpaper]) -> None:
+        for wallpaper in wallpapers:
+            self.append(wallpaper)
+
+    def remove_entries(self, entry_indices: Iterable[int]) -> None:
+        with self.lock:
+            for entry_index in entry_indices:
+                state = self.entry_states[entry_index]
+
+                if state == STATE_REMOVED:
+                    continue
+
+                if state == STATE_INVALID:
+                    self.invalid_count -= 1
+
+                self.entry_states[entry_index] = STATE_REMOVED
+                self.removed_count += 1
+
+    def add_from_path(self, path: str) -> List[str]:
+        """
+        Bring the wallpapers found in the given path and its subdirectories in sync with the file system.
+
+        Only directories whose mtime changed since they were last scanned are listed again.
+
+        Returns the directories which were added to the list.
+        """
+
+        path = os.path.normpath(path)
+        seen_directories = set()
+        added_directories = []
+
+        # The scan only reads entries which are already in the list, so the list itself can serve as the previous one
+        for directory, mtime, added_wallpapers, removed_entries in self.scan([path], self):
+            if directory not in self.directories:
+                added_directories.append(directory)
+
+            seen_directories.add(directory)
+            self.apply_scan_result(directory, mtime, added_wallpapers, removed_entries)
+
+        # Keep everything if the path itself could not be listed, it might just not be available right now
+        if path in seen_directories:
+            self.remove_unseen_directories(path, seen_directories)
+
+        return added_directories
+
+    def apply_scan_result(self, directory: str, mtime: float, added_wallpapers: List[Wallpaper], removed_entries: List[int]) -> None:
+        # The catalog stores the directories by their ID, including those only containing subdirectories
+        self.get_directory_id(directory)
+        self.directories[directory] = mtime
+        self.remove_entries(removed_entries)
+        self.extend(added_wallpapers)
+
+    def remove_unseen_directories(self, path: str, seen_directories: Set[str]) -> List[str]:
+        """
+        Remove all directories in the given path (and their wallpapers) which have not been seen by the last scan.
+
+        Returns the removed directories.
+        """
+
+        prefix = os.path.join(path, "")
+        removed_directories = [directory for directory in self.directories if (directory == path or directory.startswith(prefix)) and directory not in seen_directories]
+
+        self.remove_directories(removed_directories)
+
+        return removed_directories
+
+    def remove_directories(self, directories: Iterable[str]) -> None:
+        for directory in directories:
+            del self.directories[directory]
+            self.remove_entries(self.get_entries_in_directory(directory))
+
+    @staticmethod
+    def scan(paths: Iterable[str], previous: Optional["WallpaperList"] = None, recursive: bool = True) -> Iterator[Tuple[str, float, List[Wallpaper], List[int]]]:
+        """
+        Scan the given paths and their subdirectories, yielding the changes in every directory compared to the previous
+        list.
+
+        Every directory is yielded with its mtime, the wallpapers to add and the indices of the entries to remove from
+        the previous list. Directories whose mtime did not change since the previous list was scanned are not listed
+        again, so that rescanning an unchanged folder only costs a stat call per directory.
+
+        If not recursive, the given paths are listed even if their mtime did not change (the watcher also reports
+        changed attributes of files, like their mtime, which do not change the mtime of the directory), but of their
+        subdirectories only those not in the previous list are scanned.
+        """
+
+        paths = [os.path.normpath(path) for path in paths]
+
+        previous_directories: Dict[str, float] = {}
+        previous_subdirectories: Dict[str, List[str]] = {}
+
+        if previous is not None:
+            # Build the index up front, the directories are looked up from multiple threads
+            previous.index_directories()
+            previous_directories = dict(previous.directories)
+
+            for directory in previous_directories:
+                previous_subdirectories.setdefault(os.path.dirname(directory), []).append(directory)
+
+        if not recursive:
+            # An mtime of NaN never matches the current one
+            previous_directories.update((path, float("nan")) for path in paths)
+
+        def list_directory(directory: str) -> Optional[Tuple[str, float, List[Wallpaper], List[int], List[str]]]:
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                return None
+
+            if previous_directories.get(directory) == mtime:
+                return directory, mtime, [], [], previous_subdirectories.get(directory, [])
+
+            known = {}
+
+            for entry_index in previous.get_entries_in_directory(directory) if previous is not None else []:
+                wallpaper = previous.get_entry(entry_index)
+                known[wallpaper.file_path] = entry_index, wallpaper
+
+            wallpapers = []
+            subdirectories = []
+
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                return None
+
+            for entry in entries:
+                try:
+                    # The entry type is known from listing the directory, only files need a stat call
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                        continue
+
+                    if not entry.is_file():
+                        continue
+
+                    stat = entry.stat()
+                except OSError:
+                    continue
+
+                entry_index, wallpaper = known.get(entry.path, (None, None))
+
+                # Keep the entry (including its known validity) as long as the file did not change
+                if wallpaper is not None and wallpaper.size == stat.st_size and wallpaper.mtime == stat.st_mtime:
+                    del known[entry.path]
+                else:
+                    wallpapers.append(Wallpaper(entry.path, stat.st_size, stat.st_mtime))
+
+            # Anything left in known has been removed or changed
+            return directory, mtime, wallpapers, [entry_index for entry_index, wallpaper in known.values()], subdirectories
+
+        import concurrent.futures
+
+        # Directories are listed in parallel as listing them is mostly waiting for I/O, especially on network shares
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=SCAN_THREADS)
+
+        try:
+            pending = {executor.submit(list_directory, path) for path in paths}
+
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    result = future.result()
+
+                    if result is None:
+                        continue
+
+                    directory, mtime, wallpapers, removed_entries, subdirectories = result
+
+                    if not recursive:
+                        subdirectories = [subdirectory for subdirectory in subdirectories if subdirectory not in previous_directories]
+
+                    pending.update(executor.submit(list_directory, subdirectory) for subdirectory in subdirectories)
+
+                    yield directory, mtime, wallpapers, removed_entries
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def previous(self) -> bool:
+        return self.move(-1)
+
+    def next(self) -> bool:
+        return self.move(1)
+
+    def move(self, step: int) -> bool:
+        """
+        Move to the next valid wallpaper in the given direction.
+
+        Wallpapers known to be invalid are skipped without touching the file, only those not validated in the
+        background yet are checked on the way. Only fails if there is no valid wallpaper at all.
+        """
+
+        position = self.find_position(step)
+
+        if position is None:
+            return False
+
+        self.position = position
+
+        return True
+
+    def find_position(self, step: int, position: Optional[int] = None) -> Optional[int]:
+        """
+        Get the position of the next valid wallpaper in the given direction (starting at the current position by
+        default) without moving to it.
+        """
+
+        if not len(self):
+            return None
+
+        if position is None:
+            position = self.position
+
+        size = self.permutation.size
+
+        for try_no in range(size):
+            position = (position + step) % size
+
+            entry_index = self.permutation[position]
+
+            if entry_index < len(self.entry_states) and self.is_valid(entry_index):
+                return position
+
+        return None
+
+    def get_following(self, count: int) -> List[Wallpaper]:
+        """
+        Get the given number of valid wallpapers following the current one in the rotation.
+
+        Wallpapers are repeated if there are not enough valid ones.
+        """
+
+        wallpapers = []
+        position = self.position
+
+        for wallpaper_no in range(count):
+            position = self.find_position(1, position)
+
+            if position is None:
+                break
+
+            wallpapers.append(self.get_entry(self.permutation[position]))
+
+        return wallpapers
+
+    def is_valid(self, entry_index: int) -> bool:
+        state = self.entry_states[entry_index]
+
+        if state == STATE_UNKNOWN:
+            valid = self.get_entry(entry_index).is_valid()
+
+            # The entry might have been removed or checked by another thread in the meantime
+            with self.lock:
+                state = self.entry_states[entry_index]
+
+                if state == STATE_UNKNOWN:
+                    state = STATE_VALID if valid else STATE_INVALID
+                    self.entry_states[entry_index] = state
+
+                    if not valid:
+                        self.invalid_count += 1
+
+        return state == STATE_VALID
+
+    def get_unvalidated(self) -> array.array:
+        return array.array("I", (entry_index for entry_index, state in enumerate(self.entry_states) if state == STATE_UNKNOWN))
+
+    def get_current_index(self) -> Optional[int]:
+        entry_index = self.permutation[self.position]
+
+        if entry_index >= len(self.entry_states) or self.entry_states[entry_index] == STATE_REMOVED:
+            return None
+
+        return entry_index
+
+    def get_current(self) -> Optional[Wallpaper]:
+        entry_index = self.get_current_index()
+
+        if entry_index is None:
+            return None
+
+        return self.get_entry(entry_index)
+
+    def set_current_index(self, entry_index: int) -> None:
+        self.position = self.permutation.index(entry_index)
+
+    def restore_rotation(self, seed: int, position: int, history: List[str]) -> None:
+        """
+        Restore the rotation order, position and history saved before.
+
+        If the entries changed in the meantime (e.g. removed files were dropped from the catalog), the position does
+        not point to the last shown wallpaper anymore, which is then looked up by its path instead.
+        """
+
+        self.permutation = Permutation(seed, self.permutation.bits)
+        self.position = position % self.permutation.size
+        self.history.clear()
+        self.history.extend(history)
+
+        if not self.history:
+            return
+
+        current_wallpaper = self.get_current()
+
+        if current_wallpaper is None or current_wallpaper.file_path != self.history[-1]:
+            entry_index = self.find(self.history[-1])
+
+            if entry_index is not None:
+                self.set_current_index(entry_index)
+
+    def find(self, file_path: str) -> Optional[int]:
+        for entry_index in self.get_entries_in_directory(os.path.dirname(file_path)):
+            if self.get_entry(entry_index).file_path == file_path:
+                return entry_index
+
+        return None
+
+
+class WallpaperCatalog:
+    """
+    Persistent catalog of all wallpapers found in a folder, stored in a SQLite database in the cache directory.
+
+    Loading the catalog is much faster than walking the folder tree, so it is used to get the wallpaper list ready
+    at startup while the folder is reconciled against the file system afterwards.
+
+    The catalog remembers what has been loaded or saved for every folder, so saving again only writes the chunks and
+    directories which changed since then. The connection may be used from another thread, but only by one at a time.
+    """
+
+    def __init__(self, file_path: str):
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+
+        # The states, directories and number of directory ids of every folder as stored in the catalog
+        self.saved: Dict[str, Tuple[bytes, Dict[str, float], int]] = {}
+
+        with self.connection:
+            # The catalog is only a cache, so older versions are dropped instead of migrated
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] < CATALOG_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS wallpapers")
+                self.connection.execute("DROP TABLE IF EXISTS directories")
+                self.connection.execute("PRAGMA user_version = {}".format(CATALOG_VERSION))
+
+            # The entries are stored as the arrays of the WallpaperList, split into chunks of CATALOG_CHUNK_SIZE
+            # entries, which allows to load them in bulk
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS wallpapers (
+                    folder TEXT NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    directory_ids BLOB NOT NULL,
+                    names BLOB NOT NULL,
+                    name_offsets BLOB NOT NULL,
+                    sizes BLOB NOT NULL,
+                    mtimes BLOB NOT NULL,
+                    states BLOB NOT NULL,
+                    PRIMARY KEY (folder, chunk)
+                )
+            """)
+            # Directories which are not part of the folder anymore have no mtime, but keep their id
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS directories (
+                    folder TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    mtime REAL,
+                    PRIMARY KEY (folder, id)
+                ) WITHOUT ROWID
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS rotation (
+                    folder TEXT NOT NULL PRIMARY KEY,
+                    seed INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    history TEXT NOT NULL
+                )
+            """)
+
+    @staticmethod
+    def get_default_path() -> str:
+        cache_dir = os.path.join(QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericCacheLocation), "WallpaperChanger")
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        return os.path.join(cache_dir, "catalog.sqlite")
+
+    def load(self, folder: str, wallpapers: WallpaperList) -> None:
+        rows = self.connection.execute("SELECT path, mtime FROM directories WHERE folder = ? ORDER BY id", (folder,))
+
+        for directory, mtime in rows:
+            wallpapers.get_directory_id(directory)
+
+            if mtime is not None:
+                wallpapers.directories[directory] = mtime
+
+        rows = self.connection.execute("SELECT directory_ids, names, name_offsets, sizes, mtimes, states FROM wallpapers WHERE folder = ? ORDER BY chunk", (folder,))
+
+        for row in rows:
+            wallpapers.extend_chunk(*row)
+
+        # Removed entries are kept to keep the indices stable, until there are too many of them. The indices change
+        # then, so the whole folder is written by the next save.
+        if wallpapers.removed_count > len(wallpapers.entry_states) * CATALOG_COMPACT_RATIO:
+            wallpapers.compact()
+            self.saved.pop(folder, None)
+        else:
+            self.saved[folder] = bytes(wallpapers.entry_states), dict(wallpapers.directories), len(wallpapers.directory_paths)
+
+        row = self.connection.execute("SELECT seed, position, history FROM rotation WHERE folder = ?", (folder,)).fetchone()
+
+        if row is not None:
+            seed, position, history = row
+
+            wallpapers.restore_rotation(seed, position, json.loads(history))
+
+    def save(self, folder: str, wallpapers: WallpaperList) -> None:
+        """
+        Store the wallpaper list of the given folder, which must not be changed while it is saved.
+
+        Entries are only appended to the list and only their states change, so a chunk of entries is written again if
+        its states differ from the saved ones.
+        """
+
+        states = bytes(wallpapers.entry_states)
+        directories = dict(wallpapers.directories)
+        directory_count = len(wallpapers.directory_paths)
+
+        with self.connection:
+            if folder in self.saved:
+                saved_states, saved_directories, saved_directory_count = self.saved[folder]
+            else:
+                self.connection.execute("DELETE FROM wallpapers WHERE folder = ?", (folder,))
+                self.connection.execute("DELETE FROM directories WHERE folder = ?", (folder,))
+
+                saved_states, saved_directories, saved_directory_count = b"", {}, 0
+
+            changed_chunks = (
+                chunk_no for chunk_no in range(wallpapers.get_chunk_count())
+                if states[chunk_no * CATALOG_CHUNK_SIZE:(chunk_no + 1) * CATALOG_CHUNK_SIZE] != saved_states[chunk_no * CATALOG_CHUNK_SIZE:(chunk_no + 1) * CATALOG_CHUNK_SIZE]
+            )
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO wallpapers (folder, chunk, directory_ids, names, name_offsets, sizes, mtimes, states) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((folder, chunk_no) + wallpapers.get_chunk(chunk_no) for chunk_no in changed_chunks)
+            )
+
+            changed_directories = (
+                (directory_id, directory) for directory_id, directory in enumerate(wallpapers.directory_paths[:directory_count])
+                if directory_id >= saved_directory_count or directories.get(directory) != saved_directories.get(directory)
+            )
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO directories (folder, id, path, mtime) VALUES (?, ?, ?, ?)",
+                ((folder, directory_id, directory, directories.get(directory)) for directory_id, directory in changed_directories)
+            )
+
+        self.saved[folder] = states, directories, directory_count
+
+    def save_rotation(self, folder: str, seed: int, position: int, history: List[str]) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO rotation (folder, seed, position, history) VALUES (?, ?, ?, ?)",
+                (folder, seed, position, json.dumps(history))
+            )
+
+
+class CatalogWorker(QtCore.QRunnable):
+    """
+    Write to the catalog in a thread pool with a single thread, so that there is only one writer at a time and the GUI
+    thread never waits for the database.
+    """
+
+    def __init__(self, function: Callable, *arguments):
+        super().__init__()
 
-class Wallpaper:
-    def __init__(self, file_path):
-        self.file_path = file_path
+        self.function = function
+        self.arguments = arguments
 
-    def is_valid(self) -> bool:
-        return imghdr.what(self.file_path) is not None
+    def run(self):
+        try:
+            self.function(*self.arguments)
+        except sqlite3.Error as exception:
+            print("Unable to save the catalog: {}".format(exception), file=sys.stderr)
 
-    def set_active_linux(self) -> None:
-        desktop_session = os.environ.get("DESKTOP_SESSION")
 
-        if desktop_session is not None:
-            desktop_session = desktop_session.lower()
+class ScanSignals(QtCore.QObject):
+    results_found = QtCore.pyqtSignal(object, list)
 
-            if desktop_session in ["gnome", "gnome-wayland", "unity", "ubuntu", "pantheon", "budgie-desktop", "pop"]:
-                subprocess.call(["gsettings", "set", "org.gnome.desktop.background", "picture-uri", QtCore.QUrl.fromLocalFile(self.file_path).toString()])
-            elif desktop_session in ["cinnamon"]:
-                subprocess.call(["gsettings", "set", "org.cinnamon.desktop.background", "picture-uri", QtCore.QUrl.fromLocalFile(self.file_path).toString()])
-            elif desktop_session in ["mate"]:
-                subprocess.call(["gsettings", "set", "org.mate.background", "picture-filename", QtCore.QUrl.fromLocalFile(self.file_path).toString()])
-            elif desktop_session in ["plasma", "kde"]:
-                # TODO: Implement support for KDE
-                pass
+    # The removed directories, or None if the scan failed
+    finished = QtCore.pyqtSignal(object, object)
 
-    def set_active_macos(self) -> None:
-        script = """
-            /usr/bin/osascript<<END
-            tell application "Finder"
-            set desktop picture to POSIX file "{}"
-            end tell
-            END
-        """
 
-        subprocess.Popen(script.format(self.file_path), shell=True)
+class ScanWorker(QtCore.QRunnable):
+    """
+    Scan a folder in a thread pool, streaming the changes of every directory back in batches.
 
-    def set_active_windows(self) -> None:
-        ctypes.windll.user32.SystemParametersInfoW(20, 0, self.file_path, 0)
+    If changed directories are given (as reported by the watcher), only those are listed again instead of the whole
+    folder, together with new subdirectories found in them.
 
-    def set_active(self) -> None:
-        if platform.system() == "Windows":
-            self.set_active_windows()
-            pass
-        elif platform.system() == "Darwin":
-            self.set_active_macos()
-            pass
+    The changes are applied to the given copy of the wallpaper list as well, which can be stored in the catalog once
+    the scan is complete.
+    """
+
+    def __init__(self, path: str, wallpapers: WallpaperList, changed_directories: Optional[Iterable[str]] = None):
+        super().__init__()
+
+        self.path = os.path.normpath(path)
+        self.wallpapers = wallpapers
+        self.changed_directories = None if changed_directories is None else sorted(changed_directories)
+        self.cancelled = False
+        self.signals = ScanSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            removed_directories = self.scan()
+        except Exception as exception:
+            print("Unable to scan {}: {}".format(self.path, exception), file=sys.stderr)
+            removed_directories = None
+
+        if not self.cancelled:
+            self.signals.finished.emit(self, removed_directories)
+
+    def scan(self) -> Optional[List[str]]:
+        seen_directories = set()
+        results = []
+        batch_size = 0
+        found_wallpapers = False
+
+        if self.changed_directories is None:
+            scan_results = WallpaperList.scan([self.path], self.wallpapers)
         else:
-            self.set_active_linux()
+            scan_results = WallpaperList.scan(self.changed_directories, self.wallpapers, recursive=False)
 
+        for result in scan_results:
+            if self.cancelled:
+                return None
 
-class WallpaperList(list):
-    def __init__(self):
+            directory, mtime, added_wallpapers, removed_entries = result
+
+            seen_directories.add(directory)
+            self.wallpapers.apply_scan_result(directory, mtime, added_wallpapers, removed_entries)
+
+            results.append(result)
+            batch_size += 1 + len(added_wallpapers) + len(removed_entries)
+
+            # Pass the first wallpapers immediately so that one can be shown as early as possible
+            if batch_size >= SCAN_BATCH_SIZE or (added_wallpapers and not found_wallpapers):
+                self.signals.results_found.emit(self, results)
+                results = []
+                batch_size = 0
+                found_wallpapers = True
+
+        if results:
+            self.signals.results_found.emit(self, results)
+
+        if self.changed_directories is None:
+            # Without the folder itself (e.g. a share which is not mounted), every directory would be considered removed
+            if self.path not in seen_directories:
+                print("Unable to list {}".format(self.path), file=sys.stderr)
+                return None
+
+            return self.wallpapers.remove_unseen_directories(self.path, seen_directories)
+
+        removed_directories = []
+
+        # A changed directory which is gone is removed with its subdirectories, but only as long as its parent still
+        # exists (it might be on a share which is not mounted anymore)
+        for directory in self.changed_directories:
+            if directory in seen_directories or directory == self.path or os.path.exists(directory) or not os.path.isdir(os.path.dirname(directory)):
+                continue
+
+            removed_directories.extend(self.wallpapers.remove_unseen_directories(directory, seen_directories))
+
+        return removed_directories
+
+
+class ValidationSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object)
+
+
+class ValidationWorker(QtCore.QRunnable):
+    """
+    Check the validity of the given entries of a wallpaper list using a bounded number of threads.
+
+    The result is cached in the list, so the rotation does not have to check them anymore.
+    """
+
+    def __init__(self, wallpapers: WallpaperList, entry_indices: Sequence[int]):
         super().__init__()
 
-        self.current_index = 0
+        self.wallpapers = wallpapers
+        self.entry_indices = entry_indices
+        self.cancelled = False
+        self.signals = ValidationSignals()
 
-    def add_from_path(self, path: str) -> None:
-        for current_path, folders, files in os.walk(path):
-            for file in files:
-                self.append(Wallpaper(os.path.join(current_path, file)))
+    def cancel(self):
+        self.cancelled = True
 
-        random.shuffle(self)
+    def validate(self, entry_indices: Iterator[int], lock: threading.Lock):
+        while not self.cancelled:
+            with lock:
+                entry_index = next(entry_indices, None)
 
-    def previous(self) -> bool:
-        for try_no in range(10):
-            if self.current_index <= 0:
-                self.current_index = len(self) - 1
-            else:
-                self.current_index -= 1
+            if entry_index is None:
+                return
 
-            if self.get_current().is_valid():
-                return True
+            self.wallpapers.is_valid(entry_index)
 
-        return False
+    def run(self):
+        import concurrent.futures
 
-    def next(self) -> bool:
-        for try_no in range(10):
-            if self.current_index >= len(self) - 1:
-                self.current_index = 0
+        # Every thread takes the next entry from the shared iterator, so there is no future per entry
+        entry_indices = iter(self.entry_indices)
+        lock = threading.Lock()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=VALIDATION_THREADS) as executor:
+            futures = [executor.submit(self.validate, entry_indices, lock) for thread_no in range(VALIDATION_THREADS)]
+
+        for future in futures:
+            try:
+                future.result()
+            except Exception as exception:
+                print("Unable to validate wallpapers: {}".format(exception), file=sys.stderr)
+
+        if not self.cancelled:
+            self.signals.finished.emit(self)
+
+
+class PrefetchSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object)
+
+
+class PrefetchWorker(QtCore.QRunnable):
+    """
+    Prepare the next wallpaper of the rotation in a thread pool, so changing to it does not have to wait for the disk.
+
+    The next wallpaper is validated and either scaled into the cache or read ahead into the page cache.
+    """
+
+    def __init__(self, wallpapers: WallpaperList, scaled_cache: Optional[ScaledWallpaperCache] = None, screen_size: Optional[QtCore.QSize] = None):
+        super().__init__()
+
+        self.wallpapers = wallpapers
+        self.scaled_cache = scaled_cache
+        self.screen_size = screen_size
+        self.signals = PrefetchSignals()
+
+    def run(self):
+        try:
+            position = self.wallpapers.find_position(1)
+
+            if position is not None:
+                self.prefetch(self.wallpapers.get_entry(self.wallpapers.permutation[position]))
+        except Exception as exception:
+            print("Unable to prefetch next wallpaper: {}".format(exception), file=sys.stderr)
+
+        self.signals.finished.emit(self)
+
+    def prefetch(self, wallpaper: Wallpaper):
+        if self.scaled_cache is not None and self.screen_size is not None:
+            self.scaled_cache.get_scaled(wallpaper, self.screen_size)
+            return
+
+        fd = os.open(wallpaper.file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+        try:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
             else:
-                self.current_index += 1
+                while os.read(fd, 1024 * 1024):
+                    pass
+        finally:
+            os.close(fd)
 
-            if self.get_current().is_valid():
-                return True
 
-        return False
+class ApplySignals(QtCore.QObject):
+    started = QtCore.pyqtSignal(object)
+    finished = QtCore.pyqtSignal(object, object, float)
 
-    def get_current(self) -> Optional[Wallpaper]:
-        if not len(self):
-            return None
 
-        if self.current_index > len(self) - 1:
-            self.current_index = 0
+class ApplyWorker(QtCore.QRunnable):
+    """
+    Set a wallpaper as desktop wallpaper in a thread pool, passing the error (if any) and the latency when finished.
+
+    If screen geometries are given, the screen wallpapers are composed into one image spanning all screens instead.
+    """
+
+    def __init__(self, wallpaper: Wallpaper, scaled_cache: Optional[ScaledWallpaperCache] = None, screen_size: Optional[QtCore.QSize] = None,
+                 screen_wallpapers: Optional[List[Wallpaper]] = None, screen_geometries: Optional[List[QtCore.QRect]] = None):
+        super().__init__()
+
+        self.wallpaper = wallpaper
+        self.scaled_cache = scaled_cache
+        self.screen_size = screen_size
+        self.screen_wallpapers = screen_wallpapers
+        self.screen_geometries = screen_geometries
+        self.signals = ApplySignals()
 
-        return self[self.current_index]
+    def run(self):
+        self.signals.started.emit(self)
+
+        start_time = time.monotonic()
+        error = None
+
+        try:
+            if self.screen_geometries:
+                backend = get_backend()
+
+                if backend is not None:
+                    backend.set_spanned_wallpaper(self.scaled_cache.get_composite(self.screen_wallpapers, self.screen_geometries))
+            else:
+                self.wallpaper.set_active(self.scaled_cache, self.screen_size)
+        except Exception as exception:
+            error = exception
+
+        self.signals.finished.emit(self, error, time.monotonic() - start_time)
 
 
 if dbus:
     class DBusHandler(dbus.service.Object):
-        def __init__(self, main_window: "MainWindow", session_bus: dbus.Bus):
+        """
+        D-Bus interface to control the wallpaper rotation.
+
+        The status is also exposed as read-only properties, changes are announced using PropertiesChanged, so clients
+        do not have to poll it.
+        """
+
+        def __init__(self, wallpaper_changer: "WallpaperChanger", session_bus: dbus.Bus):
             dbus.service.Object.__init__(self, session_bus, "/")
 
-            self.main_window = main_window
+            self.wallpaper_changer = wallpaper_changer
+            self.wallpaper_changer.wallpaper_changed.connect(self.handle_wallpaper_changed)
+            self.wallpaper_changer.wallpaper_changed.connect(self.update_properties)
+            self.wallpaper_changer.wallpapers_changed.connect(self.update_properties)
+            self.wallpaper_changer.pause_changed.connect(self.update_properties)
+
+            self.properties = self.get_status()
+
+        def handle_wallpaper_changed(self):
+            entry_index = self.wallpaper_changer.wallpapers.get_current_index()
+
+            if entry_index is not None:
+                self.wallpaper_changed(self.wallpaper_changer.wallpapers.get_entry(entry_index).file_path, entry_index)
+
+        def update_properties(self):
+            status = self.get_status()
+
+            # The time to the next change decreases all the time and the latency differs after every change, they are only
+            # passed along with other changes
+            passed_along = ("time_to_next_change", "last_apply_latency")
+            changed_properties = {name: value for name, value in status.items() if name not in passed_along and value != self.properties.get(name)}
+
+            self.properties = status
+
+            if changed_properties:
+                changed_properties.update((name, status[name]) for name in passed_along)
+
+                self.PropertiesChanged("com.selfcoders.WallpaperChanger", dbus.Dictionary(changed_properties, signature="sv"), dbus.Array([], signature="s"))
 
         @dbus.service.method("com.selfcoders.WallpaperChanger", in_signature="", out_signature="")
         def toggle_pause(self):
-            self.main_window.toggle_pause()
+            self.wallpaper_changer.toggle_pause()
 
         @dbus.service.method("com.selfcoders.WallpaperChanger", in_signature="", out_signature="")
         def previous_wallpaper(self):
-            self.main_window.previous_wallpaper()
+            self.wallpaper_changer.previous_wallpaper()
 
         @dbus.service.method("com.selfcoders.WallpaperChanger", in_signature="", out_signature="")
         def next_wallpaper(self):
-            self.main_window.next_wallpaper()
+            self.wallpaper_changer.next_wallpaper()
 
         @dbus.service.method("com.selfcoders.WallpaperChanger", in_signature="", out_signature="")
         def open_wallpaper(self):
-            self.main_window.open_wallpaper()
+            self.wallpaper_changer.open_wallpaper()
 
         @dbus.service.method("com.selfcoders.WallpaperChanger", in_signature="", out_signature="s")
         def get_current_wallpaper(self):
-            return self.main_window.wallpapers.get_current().file_path
-
+            return self.wallpaper_changer.wallpapers.get_current().file_path
+
+        @dbus.service.method("com.selfcoders.WallpaperChanger", in_signature="", out_signature="a{sv}")
+        def get_status(self):
+            """
+            Get the current wallpaper and the state of the rotation at once.
+
+            Times are given in seconds, -1 is used if there is no current wallpaper, the rotation is paused or no
+            wallpaper has been set yet.
+            """
+
+            wallpaper_changer = self.wallpaper_changer
+            entry_index = wallpaper_changer.wallpapers.get_current_index()
+            remaining_time = wallpaper_changer.timer.remainingTime()
+
+            return dbus.Dictionary({
+                "current_wallpaper": dbus.String("" if entry_index is None else wallpaper_changer.wallpapers.get_entry(entry_index).file_path),
+                "index": dbus.Int32(-1 if entry_index is None else entry_index),
+                "count": dbus.UInt32(len(wallpaper_changer.wallpapers)),
+                "paused": dbus.Boolean(wallpaper_changer.is_paused()),
+                "time_to_next_change": dbus.Double(-1 if remaining_time < 0 else remaining_time / 1000),
+                "last_apply_latency": dbus.Double(-1 if wallpaper_changer.last_apply_latency is None else wallpaper_changer.last_apply_latency),
+            }, signature="sv")
+
+        @dbus.service.signal("com.selfcoders.WallpaperChanger", signature="si")
+        def wallpaper_changed(self, file_path: str, index: int):
+            pass
 
-class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, dbus_session):
-        super().__init__()
+        @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature="ss", out_signature="v")
+        def Get(self, interface_name: str, property_name: str):
+            properties = self.GetAll(interface_name)
 
-        self.wallpapers = WallpaperList()
-        self.current_wallpaper_index = 0
+            if property_name not in properties:
+                raise dbus.exceptions.DBusException("Unknown property {}".format(property_name), name="org.freedesktop.DBus.Error.UnknownProperty")
 
-        self.timer = QtCore.QTimer(self)
-        self.timer.setSingleShot(True)
-        self.timer.timeout.connect(self.next_wallpaper)
+            return properties[property_name]
 
-        self.setFixedWidth(500)
-        self.setFixedHeight(150)
+        @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature="s", out_signature="a{sv}")
+        def GetAll(self, interface_name: str):
+            if interface_name != "com.selfcoders.WallpaperChanger":
+                raise dbus.exceptions.DBusException("Unknown interface {}".format(interface_name), name="org.freedesktop.DBus.Error.UnknownInterface")
 
-        central_widget = QtWidgets.QWidget()
-        self.setCentralWidget(central_widget)
+            return self.get_status()
 
-        layout = QtWidgets.QVBoxLayout()
-        central_widget.setLayout(layout)
+        @dbus.service.method(dbus.PROPERTIES_IFACE, in_signature="ssv", out_signature="")
+        def Set(self, interface_name: str, property_name: str, value):
+            raise dbus.exceptions.DBusException("Property {} is read-only".format(property_name), name="org.freedesktop.DBus.Error.PropertyReadOnly")
 
-        form_container = QtWidgets.QWidget()
-        layout.addWidget(form_container)
+        @dbus.service.signal(dbus.PROPERTIES_IFACE, signature="sa{sv}as")
+        def PropertiesChanged(self, interface_name: str, changed_properties: dict, invalidated_properties: list):
+            pass
 
-        form_layout = QtWidgets.QGridLayout()
-        form_container.setLayout(form_layout)
 
-        form_layout.addWidget(QtWidgets.QLabel("Folder:"), 0, 0)
+class WallpaperChanger(QtCore.QObject):
+    """
+    Rotate the wallpapers of the configured folder, independent of the user interface.
 
-        self.folder_field = QtWidgets.QLineEdit()
-        self.folder_field.setReadOnly(True)
-        form_layout.addWidget(self.folder_field, 0, 1)
+    The settings are read from QSettings, the tray icon and the settings window (if any) are kept up to date using
+    the signals.
+    """
 
-        browse_folder_button = QtWidgets.QPushButton("Browse")
-        browse_folder_button.clicked.connect(self.browse_folder)
-        form_layout.addWidget(browse_folder_button, 0, 2)
+    # Emitted if another wallpaper became the current one
+    wallpaper_changed = QtCore.pyqtSignal()
 
-        form_layout.addWidget(QtWidgets.QLabel("Interval:"), 1, 0)
+    # Emitted once setting a wallpaper finished (successfully or not)
 
-        self.interval_field = QtWidgets.QSpinBox()
-        self.interval_field.setMinimum(1)
-        self.interval_field.setMaximum(10000)
-        self.interval_field.setSuffix(" min")
-        form_layout.addWidget(self.interval_field, 1, 1)
+    # Emitted if wallpapers have been added to or removed from the list
+    wallpapers_changed = QtCore.pyqtSignal()
 
-        button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
-        layout.addWidget(button_box)
+    # Emitted if the rotation has been paused or continued
+    pause_changed = QtCore.pyqtSignal()
 
-        button_box.accepted.connect(self.save)
-        button_box.rejected.connect(self.close)
+    def __init__(self):
+        super().__init__()
 
-        tray_menu = QtWidgets.QMenu()
+        self.wallpapers = WallpaperList()
+        self.wallpapers_folder = None
+        self.catalog = WallpaperCatalog(WallpaperCatalog.get_default_path())
+        self.thread_pool = QtCore.QThreadPool(self)
+
+        # Setting and prefetching wallpapers must not wait for scanning or validating, so they have their own threads
+        self.apply_pool = QtCore.QThreadPool(self)
+        self.apply_pool.setMaxThreadCount(1)
+        self.prefetch_pool = QtCore.QThreadPool(self)
+        self.prefetch_pool.setMaxThreadCount(1)
+
+        # All writes to the catalog are done by a single thread
+        self.catalog_pool = QtCore.QThreadPool(self)
+        self.catalog_pool.setMaxThreadCount(1)
+        self.scan_worker: Optional[ScanWorker] = None
+        self.validation_worker: Optional[ValidationWorker] = None
+        self.apply_worker: Optional[ApplyWorker] = None
+        self.timed_out_apply_workers: Set[ApplyWorker] = set()
+        self.prefetch_worker: Optional[PrefetchWorker] = None
+        self.pending_wallpaper: Optional[Wallpaper] = None
+        self.last_apply_latency: Optional[float] = None
+        self.show_first_wallpaper = False
+        self.scaled_cache: Optional[ScaledWallpaperCache] = None
+        self.scale = False
+        self.screen_mode = SCREEN_MODE_SAME
+
+        self.apply_delay_timer = QtCore.QTimer(self)
+        self.apply_delay_timer.setSingleShot(True)
+        self.apply_delay_timer.setInterval(APPLY_DELAY)
+        self.apply_delay_timer.timeout.connect(self.apply_current_wallpaper)
+
+        self.apply_timer = QtCore.QTimer(self)
+        self.apply_timer.setSingleShot(True)
+        self.apply_timer.setInterval(APPLY_TIMEOUT * 1000)
+        self.apply_timer.timeout.connect(self.handle_apply_timeout)
 
-        tray_menu.addAction(QtGui.QIcon.fromTheme("preferences"), "Show settings", self.show)
-        tray_menu.addSeparator()
-        tray_menu.addAction(QtGui.QIcon.fromTheme("image-viewer"), "Open current wallpaper", self.open_wallpaper)
-        tray_menu.addSeparator()
-        tray_menu.addAction(self.style().standardIcon(QtWidgets.QStyle.SP_MediaSkipBackward), "Previous wallpaper", self.previous_wallpaper)
-        self.toggle_pause_action = tray_menu.addAction("", self.toggle_pause)
-        tray_menu.addAction(self.style().standardIcon(QtWidgets.QStyle.SP_MediaSkipForward), "Next wallpaper", self.next_wallpaper)
-        tray_menu.addSeparator()
-        tray_menu.addAction("Quit", self.quit)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.advance_wallpaper)
 
-        self.tray_icon = QtWidgets.QSystemTrayIcon(self)
-        self.tray_icon.setIcon(self.windowIcon())
-        self.tray_icon.setContextMenu(tray_menu)
-        self.tray_icon.activated.connect(self.handle_tray_icon_activation)
-        self.tray_icon.show()
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.handle_directory_change)
+        self.changed_directories = set()
 
-        self.load_settings()
+        self.watch_timer = QtCore.QTimer(self)
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.setInterval(WATCH_DELAY)
+        self.watch_timer.timeout.connect(self.update_changed_directories)
 
-        self.update_pause_action()
+        self.rescan_timer = QtCore.QTimer(self)
+        self.rescan_timer.setInterval(RESCAN_INTERVAL)
+        self.rescan_timer.timeout.connect(self.reconcile_wallpapers)
 
-        if dbus_session:
-            DBusHandler(self, dbus_session)
+        # Screens are only known to GUI applications, i.e. not in daemon mode
+        app = QtCore.QCoreApplication.instance()
 
-    def handle_tray_icon_activation(self, reason):
-        if reason == QtWidgets.QSystemTrayIcon.Trigger:
-            if self.isVisible():
-                self.close()
-            else:
-                self.show()
+        if isinstance(app, QtGui.QGuiApplication):
+            app.screenAdded.connect(self.handle_screens_changed)
+            app.screenRemoved.connect(self.handle_screens_changed)
 
     def quit(self):
-        QtGui.QGuiApplication.quit()
+        # Store validity information gathered since the last scan
+        if self.scan_worker:
+            self.scan_worker.cancel()
+            self.scan_worker = None
+
+        if self.validation_worker:
+            self.validation_worker.cancel()
+            self.validation_worker = None
+
+        self.thread_pool.waitForDone()
+        self.prefetch_pool.waitForDone()
+        self.apply_pool.waitForDone(APPLY_TIMEOUT * 1000)
 
-    def browse_folder(self):
-        new_folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Select folder with pictures", self.folder_field.text())
+        if self.wallpapers_folder:
+            self.catalog_pool.start(CatalogWorker(self.catalog.save, self.wallpapers_folder, self.wallpapers))
+            self.save_rotation()
 
-        if new_folder:
-            self.folder_field.setText(new_folder)
+        self.catalog_pool.waitForDone()
+
+        QtCore.QCoreApplication.quit()
 
     def open_wallpaper(self):
         wallpaper = self.wallpapers.get_current()
@@ -238,6 +2046,8 @@ class MainWindow(QtWidgets.QMainWindow):
         if wallpaper is None:
             return
 
+        import subprocess
+
         if platform.system() == "Linux":
             subprocess.call(["xdg-open", wallpaper.file_path])
         elif platform.system() == "Darwin":
@@ -245,13 +2055,8 @@ class MainWindow(QtWidgets.QMainWindow):
         elif platform.system() == "Windows":
             os.startfile(wallpaper.file_path)
 
-    def update_pause_action(self):
-        if self.timer.isActive():
-            self.toggle_pause_action.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaPause))
-            self.toggle_pause_action.setText("Pause")
-        else:
-            self.toggle_pause_action.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaPlay))
-            self.toggle_pause_action.setText("Continue")
+    def is_paused(self) -> bool:
+        return not self.timer.isActive()
 
     def toggle_pause(self):
         if self.timer.isActive():
@@ -259,79 +2064,562 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.timer.start()
 
-        self.update_pause_action()
+        self.pause_changed.emit()
+
+    def get_screen_count(self) -> int:
+        """
+        Get the number of wallpapers shown at once, i.e. the number of screens if every screen shows another one.
+        """
+
+        if self.screen_mode != SCREEN_MODE_SEPARATE:
+            return 1
+
+        return max(len(self.get_screen_geometries()), 1)
+
+    def get_screen_geometries(self) -> List[QtCore.QRect]:
+        """
+        Get the geometries of the screens to compose the wallpaper for, which is none if the same wallpaper is shown on
+        all screens (also if the backend is not able to span an image across all screens).
+        """
+
+        backend = get_backend()
+
+        if self.screen_mode == SCREEN_MODE_SAME or backend is None or not backend.supports_spanning():
+            return []
+
+        return ScaledWallpaperCache.get_screen_geometries()
+
+    def move_wallpapers(self, step: int) -> bool:
+        # Every screen shows the wallpaper following the one of the previous screen, so all of them are replaced
+        moved = False
+
+        for screen_no in range(self.get_screen_count()):
+            moved = self.wallpapers.move(step) or moved
+
+        return moved
 
     def previous_wallpaper(self):
-        if self.wallpapers.previous():
+        if self.move_wallpapers(-1):
             self.update_wallpaper()
 
     def next_wallpaper(self):
-        if self.wallpapers.next():
+        if self.move_wallpapers(1):
             self.update_wallpaper()
 
+    def advance_wallpaper(self):
+        # The next wallpaper has been prefetched already, so it is applied without waiting for further changes
+        if self.move_wallpapers(1):
+            self.wallpaper_changed.emit()
+            self.apply_current_wallpaper()
+
     def update_wallpaper(self):
+        if self.wallpapers.get_current() is None:
+            return
+
+        self.wallpaper_changed.emit()
+
+        # Wait for a short quiet period, so that only the last one of multiple changes in a row is applied
+        self.apply_delay_timer.start()
+
+    def apply_current_wallpaper(self):
+        self.apply_delay_timer.stop()
+
         wallpaper = self.wallpapers.get_current()
 
         if wallpaper is None:
             return
 
-        self.tray_icon.setToolTip("{}\n\nCurrent wallpaper: {}".format(QtGui.QGuiApplication.applicationName(), wallpaper.file_path))
+        self.apply_wallpaper(wallpaper)
 
-        wallpaper.set_active()
+        self.wallpapers.history.append(wallpaper.file_path)
+        self.save_rotation()
 
         self.timer.start()
 
-        self.update_pause_action()
+        self.pause_changed.emit()
+
+    def save_rotation(self):
+        wallpapers = self.wallpapers
+
+        self.catalog_pool.start(CatalogWorker(self.catalog.save_rotation, self.wallpapers_folder, wallpapers.permutation.seed, wallpapers.position, list(wallpapers.history)))
+
+    def apply_wallpaper(self, wallpaper: Wallpaper):
+        # Only the latest wallpaper requested while another one is being set has to be applied afterwards
+        if self.apply_worker:
+            self.pending_wallpaper = wallpaper
+            return
+
+        screen_geometries = self.get_screen_geometries()
+
+        if self.screen_mode == SCREEN_MODE_SEPARATE and len(screen_geometries) > 1:
+            screen_wallpapers = [wallpaper] + self.wallpapers.get_following(len(screen_geometries) - 1)
+
+            self.apply_worker = ApplyWorker(wallpaper, self.scaled_cache, None, screen_wallpapers, screen_geometries[:len(screen_wallpapers)])
+        elif self.screen_mode == SCREEN_MODE_SPAN and len(screen_geometries) > 1:
+            bounding_rect = QtCore.QRect()
+
+            for geometry in screen_geometries:
+                bounding_rect = bounding_rect.united(geometry)
 
-    def reload_wallpapers(self):
-        path = self.folder_field.text()
+            self.apply_worker = ApplyWorker(wallpaper, self.scaled_cache, None, [wallpaper], [bounding_rect])
+        elif self.scaled_cache is not None and self.scale:
+            self.apply_worker = ApplyWorker(wallpaper, self.scaled_cache, ScaledWallpaperCache.get_screen_size())
+        else:
+            self.apply_worker = ApplyWorker(wallpaper)
+
+        self.apply_worker.signals.started.connect(self.handle_apply_started)
+        self.apply_worker.signals.finished.connect(self.handle_apply_finished)
+        self.apply_pool.start(self.apply_worker)
+
+    def handle_apply_started(self, worker: ApplyWorker):
+        # Only the time spent setting the wallpaper counts, not waiting for a thread
+        if worker is self.apply_worker:
+            self.apply_timer.start()
+
+    def handle_apply_finished(self, worker: ApplyWorker, error: Optional[Exception], latency: float):
+        # The thread taken over from a timed out worker is not needed anymore
+        if worker in self.timed_out_apply_workers:
+            self.timed_out_apply_workers.remove(worker)
+            self.apply_pool.setMaxThreadCount(self.apply_pool.maxThreadCount() - 1)
+
+        if worker is not self.apply_worker:
+            return
+
+        self.apply_timer.stop()
+        self.apply_worker = None
+        self.last_apply_latency = latency
+
+        if error is not None:
+            print("Unable to set wallpaper {}: {}".format(worker.wallpaper.file_path, error), file=sys.stderr)
 
-        if not path:
+        if self.pending_wallpaper is None:
+            self.prefetch_wallpaper()
+        else:
+            self.apply_pending_wallpaper()
+
+    def handle_apply_timeout(self):
+        print("Setting wallpaper {} timed out".format(self.apply_worker.wallpaper.file_path), file=sys.stderr)
+
+        # The worker can not be stopped, but its result is ignored and another thread takes its place (unless too many
+        # are blocked already, the next wallpaper has to wait for them then)
+        if len(self.timed_out_apply_workers) < APPLY_MAX_TIMED_OUT:
+            self.timed_out_apply_workers.add(self.apply_worker)
+            self.apply_pool.setMaxThreadCount(self.apply_pool.maxThreadCount() + 1)
+
+        self.apply_worker = None
+
+        self.apply_pending_wallpaper()
+
+    def apply_pending_wallpaper(self):
+        if self.pending_wallpaper is None:
             return
 
-        self.wallpapers.clear()
-        self.wallpapers.add_from_path(path)
+        wallpaper = self.pending_wallpaper
+        self.pending_wallpaper = None
+
+        self.apply_wallpaper(wallpaper)
+
+    def handle_screens_changed(self):
+        wallpaper = self.wallpapers.get_current()
+
+        # Wallpapers depending on the screen setup have to be rendered again
+        if wallpaper is not None and (self.scale or self.screen_mode != SCREEN_MODE_SAME):
+            self.apply_wallpaper(wallpaper)
+
+    def prefetch_wallpaper(self):
+        # The result is stored in the caches only, so an outdated worker does not have to be cancelled
+        if self.scaled_cache is not None and self.scale:
+            self.prefetch_worker = PrefetchWorker(self.wallpapers, self.scaled_cache, ScaledWallpaperCache.get_screen_size())
+        else:
+            self.prefetch_worker = PrefetchWorker(self.wallpapers)
+
+        self.prefetch_worker.signals.finished.connect(self.handle_prefetch_finished)
+        self.prefetch_pool.start(self.prefetch_worker)
+
+    def handle_prefetch_finished(self, worker: PrefetchWorker):
+        if worker is self.prefetch_worker:
+            self.prefetch_worker = None
+
+    def reload_wallpapers(self, path: str):
+        # Changes found for the previous folder must not end up in the new list
+        if self.scan_worker:
+            self.scan_worker.cancel()
+            self.scan_worker = None
+
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+
+        self.changed_directories.clear()
+
+        self.wallpapers = WallpaperList()
+        self.wallpapers_folder = path
+
+        # The connection is shared with the catalog thread
+        self.catalog_pool.waitForDone()
+        self.catalog.load(path, self.wallpapers)
+        self.validate_wallpapers()
+
+        # Continue the rotation where it stopped, the last shown wallpaper is still set as desktop wallpaper
+        current_wallpaper = self.wallpapers.get_current()
+
+        if current_wallpaper is not None and self.wallpapers.history and current_wallpaper.file_path == self.wallpapers.history[-1]:
+            self.wallpaper_changed.emit()
+            self.prefetch_wallpaper()
+        else:
+            self.next_wallpaper()
 
-        self.next_wallpaper()
-        self.timer.setInterval(self.interval_field.value() * 1000 * 60)
         self.timer.start()
 
-        self.update_pause_action()
+        self.pause_changed.emit()
 
-    def save(self):
-        settings = QtCore.QSettings("SelfCoders", "WallpaperChanger")
+        # Reconcile the catalog with the file system once the event loop is running
+        QtCore.QTimer.singleShot(0, self.reconcile_wallpapers)
+
+    def reconcile_wallpapers(self):
+        if not self.wallpapers_folder:
+            return
+
+        if self.scan_worker:
+            self.scan_worker.cancel()
+
+            # Changed attributes of files are not picked up by a full scan, so they are updated afterwards
+            if self.scan_worker.changed_directories is not None:
+                self.changed_directories.update(self.scan_worker.changed_directories)
+
+        # Without any known wallpaper, show the first one found instead of waiting for the scan to complete
+        self.show_first_wallpaper = not len(self.wallpapers)
+
+        self.start_scan()
+
+    def start_scan(self, changed_directories: Optional[Iterable[str]] = None):
+        self.scan_worker = ScanWorker(self.wallpapers_folder, self.wallpapers.copy(), changed_directories)
+        self.scan_worker.signals.results_found.connect(self.handle_scan_results)
+        self.scan_worker.signals.finished.connect(self.handle_scan_finished)
+        self.thread_pool.start(self.scan_worker)
+
+    def handle_scan_results(self, worker: ScanWorker, results: list):
+        if worker is not self.scan_worker:
+            return
+
+        # The worker applies the same changes to its copy, so the entries stay the same in both lists
+        for directory, mtime, added_wallpapers, removed_entries in results:
+            self.wallpapers.apply_scan_result(directory, mtime, added_wallpapers, removed_entries)
+
+        if self.show_first_wallpaper and self.wallpapers.next():
+            self.show_first_wallpaper = False
+            self.update_wallpaper()
+
+    def handle_scan_finished(self, worker: ScanWorker, removed_directories: Optional[List[str]]):
+        if worker is not self.scan_worker:
+            return
+
+        self.scan_worker = None
+        self.show_first_wallpaper = False
+
+        # Directories not reached by a failed scan are kept, they might still exist
+        if removed_directories is not None:
+            self.wallpapers.remove_directories(removed_directories)
+
+            # The copy of the worker is not changed anymore, so it can be saved while the list is in use
+            self.catalog_pool.start(CatalogWorker(self.catalog.save, self.wallpapers_folder, worker.wallpapers))
+
+        if self.wallpapers.get_current() is None:
+            self.next_wallpaper()
+
+        watched_directories = self.watcher.directories()
+
+        if worker.changed_directories is None:
+            if watched_directories:
+                self.watcher.removePaths(watched_directories)
+
+            self.watch_directories(list(self.wallpapers.directories))
+        else:
+            watched_directories = set(watched_directories)
+            removed_watches = [directory for directory in removed_directories or [] if directory in watched_directories]
+
+            if removed_watches:
+                self.watcher.removePaths(removed_watches)
+
+            self.watch_directories([directory for directory in self.wallpapers.directories if directory not in watched_directories])
+
+        self.validate_wallpapers()
+
+        self.wallpapers_changed.emit()
+
+        # Apply changes reported by the watcher while the scan was running
+        if self.changed_directories:
+            self.watch_timer.start()
+
+    def validate_wallpapers(self):
+        if self.validation_worker:
+            self.validation_worker.cancel()
+            self.validation_worker = None
+
+        entry_indices = self.wallpapers.get_unvalidated()
+
+        if not entry_indices:
+            return
+
+        self.validation_worker = ValidationWorker(self.wallpapers, entry_indices)
+        self.validation_worker.signals.finished.connect(self.handle_validation_finished)
+        self.thread_pool.start(self.validation_worker)
 
-        settings.setValue("folder", self.folder_field.text())
-        settings.setValue("interval", self.interval_field.value())
+    def handle_validation_finished(self, worker: ValidationWorker):
+        if worker is self.validation_worker:
+            self.validation_worker = None
 
-        self.close()
+    def watch_directories(self, directories: List[str]):
+        if not directories:
+            return
+
+        failed_directories = self.watcher.addPaths(directories)
+
+        # Fall back to periodic incremental rescans if the watch limit has been reached
+        if failed_directories:
+            self.rescan_timer.start()
+        elif self.rescan_timer.isActive() and len(self.watcher.directories()) == len(self.wallpapers.directories):
+            self.rescan_timer.stop()
+
+    def handle_directory_change(self, directory: str):
+        self.changed_directories.add(directory)
+        self.watch_timer.start()
+
+    def update_changed_directories(self):
+        # The running scan applies its changes based on the current entries, keep them unchanged until it is finished
+        if self.scan_worker or not self.changed_directories:
+            return
+
+        changed_directories = self.changed_directories
+        self.changed_directories = set()
+
+        # Listing the directories might take a while (e.g. on network shares), so it is done by a scan worker as well
+        self.start_scan(changed_directories)
 
     def load_settings(self):
         settings = QtCore.QSettings("SelfCoders", "WallpaperChanger")
 
-        self.folder_field.setText(settings.value("folder"))
-        self.interval_field.setValue(int(settings.value("interval", 1)))
+        self.apply_settings(
+            settings.value("folder"),
+            int(settings.value("interval", 1)),
+            settings.value("scale", False, type=bool),
+            settings.value("screen_mode", SCREEN_MODE_SAME, type=int)
+        )
+
+    def apply_settings(self, folder: Optional[str], interval: int, scale: bool, screen_mode: int):
+        """
+        Apply the given settings (with the interval in minutes), only doing what is required for the ones that changed.
+        """
+
+        interval = interval * 1000 * 60
+
+        # Changing the interval restarts the timer if it is running, but keeps the current wallpaper
+        if interval != self.timer.interval():
+            self.timer.setInterval(interval)
+
+        self.scale = scale
+
+        # Scaled wallpapers and those composed for multiple screens are stored in the same cache
+        if not scale and screen_mode == SCREEN_MODE_SAME:
+            self.scaled_cache = None
+        elif self.scaled_cache is None:
+            self.scaled_cache = ScaledWallpaperCache(ScaledWallpaperCache.get_default_path())
+
+        # The screens show other wallpapers now, the other settings only affect wallpapers applied afterwards
+        if screen_mode != self.screen_mode:
+            self.screen_mode = screen_mode
+
+            if self.wallpapers_folder is not None and self.wallpapers.get_current() is not None:
+                self.apply_wallpaper(self.wallpapers.get_current())
+
+        if folder and folder != self.wallpapers_folder:
+            self.reload_wallpapers(folder)
+
+
+if not DAEMON_MODE:
+    class MainWindow(QtWidgets.QMainWindow):
+        def __init__(self, wallpaper_changer: WallpaperChanger):
+            super().__init__()
+
+            self.wallpaper_changer = wallpaper_changer
+            self.wallpaper_changer.wallpaper_changed.connect(self.update_tool_tip)
+            self.wallpaper_changer.pause_changed.connect(self.update_pause_action)
+
+            self.setFixedWidth(500)
+            self.setFixedHeight(210)
+
+            central_widget = QtWidgets.QWidget()
+            self.setCentralWidget(central_widget)
+
+            layout = QtWidgets.QVBoxLayout()
+            central_widget.setLayout(layout)
+
+            form_container = QtWidgets.QWidget()
+            layout.addWidget(form_container)
+
+            form_layout = QtWidgets.QGridLayout()
+            form_container.setLayout(form_layout)
+
+            form_layout.addWidget(QtWidgets.QLabel("Folder:"), 0, 0)
+
+            self.folder_field = QtWidgets.QLineEdit()
+            self.folder_field.setReadOnly(True)
+            form_layout.addWidget(self.folder_field, 0, 1)
+
+            browse_folder_button = QtWidgets.QPushButton("Browse")
+            browse_folder_button.clicked.connect(self.browse_folder)
+            form_layout.addWidget(browse_folder_button, 0, 2)
+
+            form_layout.addWidget(QtWidgets.QLabel("Interval:"), 1, 0)
+
+            self.interval_field = QtWidgets.QSpinBox()
+            self.interval_field.setMinimum(1)
+            self.interval_field.setMaximum(10000)
+            self.interval_field.setSuffix(" min")
+            form_layout.addWidget(self.interval_field, 1, 1)
+
+            self.scale_field = QtWidgets.QCheckBox("Scale wallpapers to the screen resolution")
+            form_layout.addWidget(self.scale_field, 2, 1)
 
-        self.reload_wallpapers()
+            form_layout.addWidget(QtWidgets.QLabel("Multiple screens:"), 3, 0)
 
-    def closeEvent(self, event: QtGui.QCloseEvent):
-        self.load_settings()
+            self.screen_mode_field = QtWidgets.QComboBox()
+            self.screen_mode_field.addItem("Same wallpaper on all screens", SCREEN_MODE_SAME)
+            self.screen_mode_field.addItem("Different wallpaper on every screen", SCREEN_MODE_SEPARATE)
+            self.screen_mode_field.addItem("Span wallpaper across all screens", SCREEN_MODE_SPAN)
+            form_layout.addWidget(self.screen_mode_field, 3, 1)
+
+            button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+            layout.addWidget(button_box)
+
+            button_box.accepted.connect(self.save)
+            button_box.rejected.connect(self.close)
+
+            tray_menu = QtWidgets.QMenu()
+
+            tray_menu.addAction(QtGui.QIcon.fromTheme("preferences"), "Show settings", self.show)
+            tray_menu.addSeparator()
+            tray_menu.addAction(QtGui.QIcon.fromTheme("image-viewer"), "Open current wallpaper", self.wallpaper_changer.open_wallpaper)
+            tray_menu.addSeparator()
+            tray_menu.addAction(self.style().standardIcon(QtWidgets.QStyle.SP_MediaSkipBackward), "Previous wallpaper", self.wallpaper_changer.previous_wallpaper)
+            self.toggle_pause_action = tray_menu.addAction("", self.wallpaper_changer.toggle_pause)
+            tray_menu.addAction(self.style().standardIcon(QtWidgets.QStyle.SP_MediaSkipForward), "Next wallpaper", self.wallpaper_changer.next_wallpaper)
+            tray_menu.addSeparator()
+            tray_menu.addAction("Quit", self.wallpaper_changer.quit)
+
+            self.tray_icon = QtWidgets.QSystemTrayIcon(self)
+            self.tray_icon.setIcon(self.windowIcon())
+            self.tray_icon.setContextMenu(tray_menu)
+            self.tray_icon.activated.connect(self.handle_tray_icon_activation)
+            self.tray_icon.show()
+
+            self.load_settings()
+
+            self.update_tool_tip()
+            self.update_pause_action()
+
+        def handle_tray_icon_activation(self, reason):
+            if reason == QtWidgets.QSystemTrayIcon.Trigger:
+                if self.isVisible():
+                    self.close()
+                else:
+                    self.show()
+
+        def browse_folder(self):
+            new_folder = QtWidgets.QFileDialog.getExistingDirectory(self, "Select folder with pictures", self.folder_field.text())
+
+            if new_folder:
+                self.folder_field.setText(new_folder)
+
+        def update_pause_action(self):
+            if self.wallpaper_changer.is_paused():
+                self.toggle_pause_action.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaPlay))
+                self.toggle_pause_action.setText("Continue")
+            else:
+                self.toggle_pause_action.setIcon(self.style().standardIcon(QtWidgets.QStyle.SP_MediaPause))
+                self.toggle_pause_action.setText("Pause")
+
+        def update_tool_tip(self):
+            wallpaper = self.wallpaper_changer.wallpapers.get_current()
+
+            if wallpaper is None:
+                return
+
+            self.tray_icon.setToolTip("{}\n\nCurrent wallpaper: {}".format(QtGui.QGuiApplication.applicationName(), wallpaper.file_path))
+
+        def save(self):
+            settings = QtCore.QSettings("SelfCoders", "WallpaperChanger")
+
+            settings.setValue("folder", self.folder_field.text())
+            settings.setValue("interval", self.interval_field.value())
+            settings.setValue("scale", self.scale_field.isChecked())
+            settings.setValue("screen_mode", self.screen_mode_field.currentData())
+
+            self.close()
+
+        def load_settings(self):
+            settings = QtCore.QSettings("SelfCoders", "WallpaperChanger")
+
+            self.folder_field.setText(settings.value("folder"))
+            self.interval_field.setValue(int(settings.value("interval", 1)))
+            self.scale_field.setChecked(settings.value("scale", False, type=bool))
+            self.screen_mode_field.setCurrentIndex(max(self.screen_mode_field.findData(settings.value("screen_mode", SCREEN_MODE_SAME, type=int)), 0))
+
+        def closeEvent(self, event: QtGui.QCloseEvent):
+            # Apply the saved settings, discarding changes in the settings window if it has been cancelled
+            self.load_settings()
+            self.wallpaper_changer.load_settings()
 
 
 def main():
-    app = QtWidgets.QApplication(sys.argv)
-    app.setQuitOnLastWindowClosed(False)
+    parser = argparse.ArgumentParser(description="Change the desktop wallpaper in a configurable interval.", allow_abbrev=False)
+    parser.add_argument("--daemon", action="store_true", help="run without tray icon and settings window, controlled using D-Bus only")
+
+    # Remaining arguments are passed to Qt. The mode has been decided by DAEMON_MODE on import already (QtWidgets is
+    # only imported if needed), the option is parsed for the help and to keep it away from Qt.
+    arguments, qt_arguments = parser.parse_known_args()
+
+    if DAEMON_MODE:
+        app = QtCore.QCoreApplication(sys.argv[:1] + qt_arguments)
+    else:
+        app = QtWidgets.QApplication(sys.argv[:1] + qt_arguments)
+        app.setQuitOnLastWindowClosed(False)
+        app.setWindowIcon(app.style().standardIcon(QtWidgets.QStyle.SP_ComputerIcon))
+
     app.setApplicationName("Wallpaper Changer")
-    app.setWindowIcon(app.style().standardIcon(QtWidgets.QStyle.SP_ComputerIcon))
 
     if dbus:
+        # Backends might use D-Bus from the thread pool setting the wallpaper
+        dbus.mainloop.glib.threads_init()
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         session_bus = dbus.SessionBus()
         bus = dbus.service.BusName("com.selfcoders.WallpaperChanger", session_bus)
+
+        register_backend("plasma", PlasmaBackend(session_bus), ["kde", "plasma", "plasmawayland"])
     else:
         session_bus = None
 
-    main_window = MainWindow(session_bus)
+    load_backend_plugins(os.path.join(QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.GenericConfigLocation), "WallpaperChanger", "backends"))
+
+    # Detect the desktop environment once at startup
+    get_backend()
+
+    wallpaper_changer = WallpaperChanger()
+    wallpaper_changer.load_settings()
+
+    if session_bus:
+        dbus_handler = DBusHandler(wallpaper_changer, session_bus)
+
+    if DAEMON_MODE:
+        # Store the catalog and the rotation when stopped (e.g. by the service manager)
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: wallpaper_changer.quit())
+        signal.signal(signal.SIGINT, lambda signal_number, frame: wallpaper_changer.quit())
+
+        # Signal handlers are only run once the Python interpreter gets control back from the Qt event loop
+        signal_timer = QtCore.QTimer()
+        signal_timer.timeout.connect(lambda: None)
+        signal_timer.start(500)
+    else:
+        main_window = MainWindow(wallpaper_changer)
 
     sys.exit(app.exec_())
 